@@ -4,36 +4,17 @@ Module holding functions for post poration analysis of volume objects.
 
 
 from pathlib import Path
-from typing import Union
+from typing import Iterable, Iterator, Union
 
 import pandas as pd
-from tqdm import tqdm
 
-from cli.paths import ANNOTATED_DF_DIR
+from cli.constants import SIZE_PRESCREEN_TOLERANCE, ANNOTATION_CHUNK_SIZE, COARSE_METRIC_TOLERANCE
+from cli.utils import get_file_stem, iter_chunks
 
 
-def get_annotations_by_id(pdb_ids: list[str]) -> tuple[list[Path], int]:
-    """
-    Given a list of PDB IDs, return the corresponding list of annotated
-    dataframe file pathes.
-    """
-    annotation_paths = [
-        (ANNOTATED_DF_DIR / f"{pdb_id}.json")
-        if (ANNOTATED_DF_DIR / f"{pdb_id}.json").is_file()
-        else None
-        for pdb_id in tqdm(pdb_ids, desc="Getting dataframe locations")
-    ]
-    missing_annotations = annotation_paths.count(None)
-    annotation_paths = [annotation_path for annotation_path in annotation_paths if annotation_path is not None]
-
-    return annotation_paths, missing_annotations
-
-
-def get_pdb_annotations(annotation_paths: list[Path]) -> dict[str, pd.DataFrame]:
-    """
-    Create a dictionary of annotation dataframes keyed by the PDB ID and resolution.
-    """
-    return {annotation_path.stem: pd.read_json(annotation_path) for annotation_path in tqdm(annotation_paths, desc="Compiling dataframes")}
+VOLUME_METRICS = ("volume", "x", "y", "z")
+SIZE_METRICS = ("atoms", "residues", "chains")
+SECONDARY_STRUCTURE_METRICS = ("helix", "strand", "coil")
 
 
 def compile_accepted_types(metrics: dict[str, Union[bool, float]]) -> set[str]:
@@ -66,23 +47,48 @@ def is_metric_in_range(
     return (metrics[metric_name] >= metric_min) and (metrics[metric_name] <= metric_max)
 
 
+def get_metric_range_mask(
+    metrics: pd.DataFrame, metric_name: str, metric_cutoffs: dict[str, Union[bool, float]]
+) -> pd.Series:
+    """
+    Return a boolean mask of the rows whose metric is within the range of min->max inclusive.
+    """
+    metric_min = metric_cutoffs[f"min_{metric_name}"]
+    metric_max = metric_cutoffs[f"max_{metric_name}"]
+
+    mask = metrics[metric_name] >= metric_min
+    if metric_max is not None:
+        mask &= metrics[metric_name] <= metric_max
+
+    return mask
+
+
+def get_metrics_mask(
+    metrics: pd.DataFrame, metric_names: tuple[str, ...], metric_cutoffs: dict[str, Union[bool, float]]
+) -> pd.Series:
+    """
+    Return a boolean mask of the rows where every named metric is within range.
+    """
+    mask = pd.Series(True, index=metrics.index)
+    for metric_name in metric_names:
+        mask &= get_metric_range_mask(metrics, metric_name, metric_cutoffs)
+
+    return mask
+
+
 def annotation_satisfies_metrics(
     annotation: pd.DataFrame, metrics: dict[str, Union[bool, float]], accepted_types: set[str]
 ) -> bool:
     """
     Ensure at least one volume object in annotation satisfies all metrics.
     """
-    for _, row in annotation.iterrows():
-        if (
-            str(row["type"]) in accepted_types
-            and is_metric_in_range(row, "volume", metrics)
-            and is_metric_in_range(row, "x", metrics)
-            and is_metric_in_range(row, "y", metrics)
-            and is_metric_in_range(row, "z", metrics)
-        ):
-            return True
+    if annotation.empty:
+        return False
 
-    return False
+    mask = annotation["type"].astype(str).isin(accepted_types)
+    mask &= get_metrics_mask(annotation, VOLUME_METRICS, metrics)
+
+    return bool(mask.any())
 
 
 def pdb_satisfies_metrics(pdb_metrics: dict[str, int], metric_cutoffs: dict[str, int]) -> bool:
@@ -100,18 +106,92 @@ def pdb_satisfies_metrics(pdb_metrics: dict[str, int], metric_cutoffs: dict[str,
     return False
 
 
+def size_estimate_may_satisfy_metrics(
+    size_estimate: dict[str, int], metric_cutoffs: dict[str, int], tolerance: float = SIZE_PRESCREEN_TOLERANCE
+) -> bool:
+    """
+    Could a PDB with these estimated size metrics fall within the ranges in `metric_cutoffs`.
+
+    Atoms and residues within `tolerance` of a cutoff are given the benefit of the doubt,
+    and the estimated chain count is treated as an upper bound.
+    """
+    for metric_name in ("atoms", "residues"):
+        if size_estimate[metric_name] < metric_cutoffs[f"min_{metric_name}"] * (1 - tolerance):
+            return False
+        metric_max = metric_cutoffs[f"max_{metric_name}"]
+        if metric_max is not None and size_estimate[metric_name] > metric_max * (1 + tolerance):
+            return False
+
+    return size_estimate["chains"] >= metric_cutoffs["min_chains"]
+
+
+def get_preparation_metrics(metrics: dict[str, int], factor: int = 2) -> dict[str, int]:
+    """
+    Relax the maximum size cutoffs in `metrics` by `factor`, so that a raw assembly
+    can be screened before cleaning (which only ever removes atoms).
+    """
+    return {
+        "min_atoms": metrics["min_atoms"],
+        "max_atoms": metrics["max_atoms"] * factor if metrics["max_atoms"] is not None else None,
+        "min_residues": metrics["min_residues"],
+        "max_residues": metrics["max_residues"] * factor if metrics["max_residues"] is not None else None,
+        "min_chains": metrics["min_chains"],
+        "max_chains": metrics["max_chains"] * factor if metrics["max_chains"] is not None else None,
+    }
+
+
+def get_coarse_metrics(
+    metrics: dict[str, Union[bool, float]], tolerance: float = COARSE_METRIC_TOLERANCE
+) -> dict[str, Union[bool, float]]:
+    """
+    Relax the volume cutoffs in `metrics` by `tolerance` either side, so that screening an annotation
+    made at a coarse voxel size does not reject volumes that may pass at a fine one.
+    """
+    coarse_metrics = dict(metrics)
+    for metric_name in VOLUME_METRICS:
+        coarse_metrics[f"min_{metric_name}"] = metrics[f"min_{metric_name}"] * (1 - tolerance)
+        if metrics[f"max_{metric_name}"] is not None:
+            coarse_metrics[f"max_{metric_name}"] = metrics[f"max_{metric_name}"] * (1 + tolerance)
+
+    return coarse_metrics
+
+
 def select_annotations_by_metrics(
     pdb_annotations: dict[str, pd.DataFrame], metrics: dict[str, Union[bool, float]]
 ) -> dict[str, pd.DataFrame]:
     """
     Subset the input dictionary into only those where the value annotation has metrics matching those in `metrics`.
+
+    All annotations are checked at once as a single frame indexed by PDB.
     """
     accepted_types = compile_accepted_types(metrics)
-    return {
-        pdb: annotation
-        for pdb, annotation in tqdm(pdb_annotations.items(), desc="Filtering PDBs")
-        if annotation_satisfies_metrics(annotation, metrics, accepted_types)
-    }
+    non_empty_annotations = {pdb: annotation for pdb, annotation in pdb_annotations.items() if not annotation.empty}
+    if len(non_empty_annotations) == 0:
+        return {}
+
+    combined_annotations = pd.concat(non_empty_annotations)
+    mask = combined_annotations["type"].astype(str).isin(accepted_types)
+    mask &= get_metrics_mask(combined_annotations, VOLUME_METRICS, metrics)
+    satisfied_pdbs = mask.groupby(level=0, sort=False).any()
+
+    return {pdb: pdb_annotations[pdb] for pdb in satisfied_pdbs[satisfied_pdbs].index}
+
+
+def iter_annotations_by_metrics(
+    annotation_paths: Iterable[Path],
+    metrics: dict[str, Union[bool, float]],
+    chunk_size: int = ANNOTATION_CHUNK_SIZE,
+) -> Iterator[str]:
+    """
+    Lazily yield the stems of the annotated dataframes with at least one volume matching `metrics`.
+
+    Dataframes are read and checked `chunk_size` at a time, so only one chunk is held in memory.
+    """
+    for annotation_path_chunk in iter_chunks(annotation_paths, chunk_size):
+        pdb_annotations = {
+            get_file_stem(annotation_path): pd.read_json(annotation_path) for annotation_path in annotation_path_chunk
+        }
+        yield from select_annotations_by_metrics(pdb_annotations, metrics)
 
 
 def is_stoichiometry_factorable(stoichiometry: dict[int, int]) -> bool:
@@ -0,0 +1,213 @@
+"""
+A compact columnar index of every volume in the annotated dataframes, so repeated
+metric queries do not need to re-read thousands of JSON files.
+
+The index is a directory of NumPy arrays, one per column, which are memory-mapped when queried.
+"""
+
+
+from pathlib import Path
+from typing import Iterable, Optional, Union
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from cli import inventory, paths, utils
+from cli.analysis import VOLUME_METRICS, compile_accepted_types
+
+
+INDEX_ARRAYS = ("stems", "stem_index", "type_names", "type_index", *VOLUME_METRICS)
+SOURCES_FILE = "sources.json"
+SHARDS_FILE = "shards.json"
+
+
+def have_annotation_index(index_dir: Path = paths.ANNOTATION_INDEX_DIR) -> bool:
+    """
+    Has an annotation index been built in `index_dir`.
+    """
+    return (index_dir / SOURCES_FILE).is_file()
+
+
+def load_annotation_index(
+    index_dir: Path = paths.ANNOTATION_INDEX_DIR, mmap_mode: Optional[str] = "r"
+) -> dict[str, np.ndarray]:
+    """
+    Load the index arrays, memory-mapped by default so nothing is read until it is used.
+    """
+    return {name: np.load(index_dir / f"{name}.npy", mmap_mode=mmap_mode) for name in INDEX_ARRAYS}
+
+
+def load_index_sources(index_dir: Path = paths.ANNOTATION_INDEX_DIR) -> dict[str, int]:
+    """
+    Load the modification times of the annotation files that make up the index, keyed by file stem.
+    """
+    if not have_annotation_index(index_dir):
+        return {}
+
+    with open(index_dir / SOURCES_FILE, mode="r", encoding="utf-8") as in_file:
+        return json.load(in_file)
+
+
+def load_index_shards(index_dir: Path = paths.ANNOTATION_INDEX_DIR) -> dict[str, int]:
+    """
+    Load the modification times of the annotation shard directories as of the last update of the index.
+    """
+    if not have_annotation_index(index_dir) or not (index_dir / SHARDS_FILE).is_file():
+        return {}
+
+    with open(index_dir / SHARDS_FILE, mode="r", encoding="utf-8") as in_file:
+        return json.load(in_file)
+
+
+def get_index_stems(
+    resolution: Optional[float] = None, index_dir: Path = paths.ANNOTATION_INDEX_DIR
+) -> dict[str, str]:
+    """
+    Return the indexed stems of annotations made at this voxel resolution, mapped to their PDB IDs.
+
+    If `resolution` is None these are the annotations saved without a resolution in their name,
+    so a coarse pass (e.g. `{id}.{coarse_resolution}`) never stands in for a final annotation.
+    """
+    index_stems = {}
+    for stem in load_index_sources(index_dir):
+        pdb_id = stem.split(".")[0]
+        if utils.get_annotation_stem(pdb_id, resolution) == stem:
+            index_stems[stem] = pdb_id
+
+    return index_stems
+
+
+def load_index_table(index_dir: Path = paths.ANNOTATION_INDEX_DIR) -> pd.DataFrame:
+    """
+    Expand the index into a single dataframe with one row per volume.
+    """
+    if not have_annotation_index(index_dir):
+        return pd.DataFrame(columns=["stem", "type", *VOLUME_METRICS])
+
+    index = load_annotation_index(index_dir, mmap_mode=None)
+    table = pd.DataFrame({name: index[name] for name in VOLUME_METRICS})
+    table.insert(0, "type", index["type_names"][index["type_index"]])
+    table.insert(0, "stem", index["stems"][index["stem_index"]])
+
+    return table
+
+
+def save_index_table(
+    table: pd.DataFrame,
+    sources: dict[str, int],
+    shards: dict[str, int],
+    index_dir: Path = paths.ANNOTATION_INDEX_DIR,
+) -> None:
+    """
+    Write the table as a set of column arrays.
+
+    The new index is written alongside the old one and swapped in once complete, so readers
+    never see a partially written index.
+    """
+    stem_index, stems = pd.factorize(table["stem"])
+    type_index, type_names = pd.factorize(table["type"].astype(str))
+    arrays = {
+        "stems": np.asarray(stems, dtype=str),
+        "stem_index": stem_index.astype(np.int32),
+        "type_names": np.asarray(type_names, dtype=str),
+        "type_index": type_index.astype(np.int16),
+        **{name: table[name].to_numpy(dtype=np.float64) for name in VOLUME_METRICS},
+    }
+
+    partial_dir = index_dir.with_name(f"{index_dir.name}.partial")
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    partial_dir.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(partial_dir / f"{name}.npy", array)
+    with open(partial_dir / SOURCES_FILE, mode="w", encoding="utf-8") as out_file:
+        json.dump(sources, out_file)
+    with open(partial_dir / SHARDS_FILE, mode="w", encoding="utf-8") as out_file:
+        json.dump(shards, out_file)
+
+    old_dir = index_dir.with_name(f"{index_dir.name}.old")
+    if index_dir.is_dir():
+        os.replace(index_dir, old_dir)
+    os.replace(partial_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def update_annotation_index(
+    annotation_dir: Path = paths.ANNOTATED_DF_DIR, index_dir: Path = paths.ANNOTATION_INDEX_DIR
+) -> tuple[int, int]:
+    """
+    Bring the index up to date with the annotated dataframes in `annotation_dir`.
+
+    Only new or modified dataframes are read, and rows from modified or deleted dataframes are dropped.
+    Returns the number of dataframes added and removed.
+
+    Adding, replacing, or removing a dataframe changes its shard directory's modification time, so
+    only the dataframes in shards that changed since the last update are listed and checked.
+    """
+    sources = load_index_sources(index_dir)
+    index_shards = load_index_shards(index_dir)
+    snapshot = inventory.refresh(annotation_dir)
+    shards = {shard: mtime for shard, (mtime, _) in snapshot.items()}
+    changed_shards = {
+        shard for shard in shards.keys() | index_shards.keys() if shards.get(shard) != index_shards.get(shard)
+    }
+
+    annotation_paths = {
+        utils.get_file_stem(annotation_path): annotation_path
+        for shard in changed_shards & shards.keys()
+        for file_name in snapshot[shard][1]
+        if (annotation_path := annotation_dir / shard / file_name).name.endswith((".json", ".json.gz"))
+    }
+    current_sources = {stem: mtime for stem, mtime in sources.items() if utils.get_shard(stem) not in changed_shards}
+    current_sources.update(
+        {stem: annotation_path.stat().st_mtime_ns for stem, annotation_path in annotation_paths.items()}
+    )
+    stale_stems = {stem for stem, mtime in sources.items() if current_sources.get(stem) != mtime}
+    new_stems = [stem for stem, mtime in current_sources.items() if sources.get(stem) != mtime]
+    if have_annotation_index(index_dir) and len(stale_stems) == 0 and len(new_stems) == 0 and shards == index_shards:
+        return 0, 0
+
+    table = load_index_table(index_dir)
+    table = table[~table["stem"].isin(stale_stems)]
+
+    new_tables = [table]
+    for stem in tqdm(new_stems, desc="Indexing dataframes"):
+        annotation = pd.read_json(annotation_paths[stem])
+        if annotation.empty:
+            continue
+        annotation = annotation[["type", *VOLUME_METRICS]]
+        annotation.insert(0, "stem", stem)
+        new_tables.append(annotation)
+    table = pd.concat(new_tables, ignore_index=True)
+
+    save_index_table(table, current_sources, shards, index_dir)
+
+    return len(new_stems), len(stale_stems - set(new_stems))
+
+
+def query_annotation_index(
+    metrics: dict[str, Union[bool, float]],
+    stems: Optional[Iterable[str]] = None,
+    index_dir: Path = paths.ANNOTATION_INDEX_DIR,
+) -> list[str]:
+    """
+    Return the stems of the annotated dataframes with at least one volume matching `metrics`,
+    optionally restricted to the given `stems`.
+    """
+    index = load_annotation_index(index_dir)
+
+    accepted_type_codes = np.flatnonzero(np.isin(index["type_names"], list(compile_accepted_types(metrics))))
+    mask = np.isin(index["type_index"], accepted_type_codes)
+    for metric_name in VOLUME_METRICS:
+        mask &= index[metric_name] >= metrics[f"min_{metric_name}"]
+        if metrics[f"max_{metric_name}"] is not None:
+            mask &= index[metric_name] <= metrics[f"max_{metric_name}"]
+
+    if stems is not None:
+        allowed_stems = np.isin(index["stems"], list(stems))
+        mask &= allowed_stems[index["stem_index"]]
+
+    return index["stems"][np.unique(index["stem_index"][mask])].tolist()
@@ -0,0 +1,198 @@
+"""
+Offline benchmarks of each pipeline stage on the test structures and on synthetic,
+scaled-up inputs, with comparison against a stored baseline.
+"""
+
+
+from functools import reduce
+from pathlib import Path
+from typing import Any, Callable
+import operator
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import biotite.structure as bts
+from biotite.structure.io import load_structure
+
+from volumizer import volumizer
+from cli import analysis, ids, pdb
+from cli.paths import TEST_DATA_DIR, RCSB_CLUSTER_DIR
+
+
+BENCHMARK_REPEATS = 5
+REGRESSION_TOLERANCE = 0.25
+BENCHMARK_STRUCTURE = TEST_DATA_DIR / "pore.pdb"
+VOLUMIZE_STRUCTURE = TEST_DATA_DIR / "pocket.pdb"
+CLUSTER_FILE = RCSB_CLUSTER_DIR / "cluster-center-ids-40.txt"
+SYNTHETIC_COPIES = (1, 8, 24)
+SYNTHETIC_CLUSTER_LINES = 100_000
+SYNTHETIC_ANNOTATIONS = 5_000
+SYNTHETIC_VOLUMES_PER_ANNOTATION = 8
+SYNTHETIC_SEED = 0
+
+
+def make_oligomer(structure: bts.AtomArray, copies: int) -> bts.AtomArray:
+    """
+    Build a synthetic assembly of `copies` translated copies of `structure`, each with its own chain IDs.
+    """
+    chain_ids, chain_indices = np.unique(structure.chain_id, return_inverse=True)
+    structure_copies = []
+    for copy_number in range(copies):
+        structure_copy = structure.copy()
+        structure_copy.chain_id = (chain_indices + copy_number * len(chain_ids)).astype(str)
+        structure_copy.coord = structure_copy.coord + copy_number * 100.0
+        structure_copies.append(structure_copy)
+
+    return reduce(operator.add, structure_copies)
+
+
+def make_cluster_lines(num_lines: int) -> list[str]:
+    """
+    Build synthetic RCSB cluster file lines, each with a few entity IDs.
+    """
+    rng = np.random.default_rng(SYNTHETIC_SEED)
+    alphabet = np.array(list("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    entity_ids = ["".join(rng.choice(alphabet, 4)) + f"_{rng.integers(1, 9)}" for _ in range(num_lines * 3)]
+
+    return [" ".join(entity_ids[i * 3 : (i + 1) * 3]) + "\n" for i in range(num_lines)]
+
+
+def make_annotations(num_annotations: int, volumes_per_annotation: int) -> dict[str, pd.DataFrame]:
+    """
+    Build synthetic annotation dataframes with random volume types and dimensions.
+    """
+    rng = np.random.default_rng(SYNTHETIC_SEED)
+    volume_types = np.array(["pore", "pocket", "cavity", "hub"])
+
+    return {
+        f"{annotation_number:04d}": pd.DataFrame(
+            {
+                "id": np.arange(volumes_per_annotation),
+                "type": rng.choice(volume_types, volumes_per_annotation),
+                "volume": rng.uniform(0.0, 5000.0, volumes_per_annotation),
+                "x": rng.uniform(0.0, 60.0, volumes_per_annotation),
+                "y": rng.uniform(0.0, 40.0, volumes_per_annotation),
+                "z": rng.uniform(0.0, 20.0, volumes_per_annotation),
+            }
+        )
+        for annotation_number in range(num_annotations)
+    }
+
+
+def volumize_into_temporary_dir(pdb_path: Path) -> None:
+    """
+    Volumize a PDB file, discarding the outputs.
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        volumizer.volumize_pdb_and_save(
+            pdb_path, Path(output_dir) / f"{pdb_path.stem}.pdb", Path(output_dir) / f"{pdb_path.stem}.json"
+        )
+
+
+def get_stoichiometry_uncached(structure: bts.AtomArray) -> dict[int, int]:
+    """
+    Compute the stoichiometry as a fresh worker would, without previously cached sequences.
+    """
+    pdb.get_protein_sequence.cache_clear()
+    return pdb.get_stoichiometry(structure)
+
+
+def get_benchmark_cases(include_volumize: bool = True) -> dict[str, Callable[[], Any]]:
+    """
+    Build the inputs for every benchmark and return a zero-argument callable for each, keyed by name.
+    """
+    with open(CLUSTER_FILE, mode="r", encoding="utf-8") as in_file:
+        cluster_lines = in_file.readlines()
+    synthetic_cluster_lines = make_cluster_lines(SYNTHETIC_CLUSTER_LINES)
+
+    annotation_metrics = {
+        "pores": True,
+        "pockets": False,
+        "cavities": True,
+        "min_volume": 1000.0,
+        "max_volume": None,
+        "min_x": 30.0,
+        "max_x": None,
+        "min_y": 15.0,
+        "max_y": None,
+        "min_z": 10.0,
+        "max_z": None,
+    }
+    annotations = make_annotations(SYNTHETIC_ANNOTATIONS, SYNTHETIC_VOLUMES_PER_ANNOTATION)
+
+    cases: dict[str, Callable[[], Any]] = {
+        "parse_cluster_file[cluster-40]": lambda: ids.parse_cluster_lines(cluster_lines),
+        f"parse_cluster_file[synthetic-{SYNTHETIC_CLUSTER_LINES}]": lambda: ids.parse_cluster_lines(
+            synthetic_cluster_lines
+        ),
+        f"select_annotations_by_metrics[synthetic-{SYNTHETIC_ANNOTATIONS}]": lambda: (
+            analysis.select_annotations_by_metrics(annotations, annotation_metrics)
+        ),
+    }
+
+    structure = load_structure(BENCHMARK_STRUCTURE)
+    for copies in SYNTHETIC_COPIES:
+        oligomer = make_oligomer(structure, copies)
+        name = f"{BENCHMARK_STRUCTURE.stem}x{copies}"
+        cases[f"get_pdb_size_metrics[{name}]"] = lambda oligomer=oligomer: pdb.get_pdb_size_metrics(oligomer)
+        cases[f"get_stoichiometry[{name}]"] = lambda oligomer=oligomer: get_stoichiometry_uncached(oligomer)
+        cases[f"get_secondary_structure[{name}]"] = lambda oligomer=oligomer: pdb.get_secondary_structure(oligomer)
+
+    if include_volumize:
+        cases[f"volumize_pdb_file[{VOLUMIZE_STRUCTURE.stem}]"] = lambda: volumize_into_temporary_dir(
+            VOLUMIZE_STRUCTURE
+        )
+
+    return cases
+
+
+def time_function(function: Callable[[], Any], repeats: int) -> dict[str, float]:
+    """
+    Call `function` `repeats` times and return the median and minimum wall time in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+
+    return {"median": statistics.median(times), "min": min(times), "repeats": repeats}
+
+
+def run_benchmarks(cases: dict[str, Callable[[], Any]], repeats: int = BENCHMARK_REPEATS) -> dict[str, Any]:
+    """
+    Time every benchmark case and return the results along with details of the machine they ran on.
+    """
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "benchmarks": {name: time_function(function, repeats) for name, function in cases.items()},
+    }
+
+
+def compare_to_baseline(
+    results: dict[str, Any], baseline: dict[str, Any], tolerance: float = REGRESSION_TOLERANCE
+) -> list[str]:
+    """
+    Return a description of every benchmark whose median time is more than `tolerance` slower than the baseline.
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+
+        baseline_median = baseline["benchmarks"][name]["median"]
+        if result["median"] > baseline_median * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['median']:.4f} s vs. baseline {baseline_median:.4f} s "
+                f"({result['median'] / baseline_median:.2f}x)"
+            )
+
+    return regressions
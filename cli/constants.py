@@ -4,6 +4,28 @@ Constants used to avoid magic numbers.
 
 PDB_ID_LENGTH = 4
 MAX_RESOLUTION = 5.0
+SIZE_PRESCREEN_TOLERANCE = 0.1
+
+ID_CHUNK_SIZE = 500
+PENDING_JOBS_PER_WORKER = 4
+PIPELINE_QUEUE_PER_WORKER = 8
+ANNOTATION_CHUNK_SIZE = 1000
+
+BATCHES_PER_WORKER = 8
+MAX_BATCH_SIZE = 64
+RATE_SAMPLE_SIZE = 1000
+
+SUPERVISOR_POLL_INTERVAL = 1.0
+VOLUMIZE_TIMEOUT = 7200.0
+LEASE_TIMEOUT = 600.0
+LEASE_RENEW_INTERVAL = 60.0
+COARSE_METRIC_TOLERANCE = 0.2
+
+RCSB_MMTF_URL = "https://mmtf.rcsb.org/v1.0/full/{pdb_id}"
+DOWNLOAD_CONNECTIONS = 8
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 1.0
+DOWNLOAD_TIMEOUT = 60.0
 
 RESIDUE_LETTER_CONVERSION = {
     "ALA": "A",
@@ -28,6 +50,8 @@ RESIDUE_LETTER_CONVERSION = {
     "TYR": "Y",
 }
 SEQUENCE_IDENTITY_CUTOFF = 0.90
+SEQUENCE_CACHE_SIZE = 1024
+STRUCTURE_CACHE_MAX_ATOMS = 2_000_000
 
 BIOTITE_SSE_CODES = {
     "helix": frozenset(["a"]),
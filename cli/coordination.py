@@ -0,0 +1,187 @@
+"""
+Coordination between nodes running over the same ID list with one data directory on shared storage.
+
+Before working on a PDB a node claims it by creating a lease file with O_CREAT | O_EXCL, which only one
+node can do (on local filesystems and NFSv3 onwards), so the nodes take disjoint work.  A lease is renewed
+while its work runs and removed when it finishes, and one left behind by a node that died is taken over
+once it has gone stale.
+
+SQLite's WAL mode relies on shared memory, which does not work across machines, so when the
+VOLUMIZER_CLI_SHARED_STORAGE environment variable is set the metric store and job ledger use
+a rollback journal instead.
+"""
+
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+import os
+import socket
+import threading
+import time
+
+from cli import paths
+from cli.constants import LEASE_RENEW_INTERVAL, LEASE_TIMEOUT
+
+
+SHARED_STORAGE_ENV_VAR = "VOLUMIZER_CLI_SHARED_STORAGE"
+
+
+def is_shared_storage() -> bool:
+    """
+    Is the data directory shared with other nodes.
+    """
+    return bool(os.environ.get(SHARED_STORAGE_ENV_VAR))
+
+
+def get_journal_mode() -> str:
+    """
+    Return the SQLite journal mode for stores in the data directory.
+    """
+    return "DELETE" if is_shared_storage() else "WAL"
+
+
+def get_owner() -> str:
+    """
+    Return a name for this process that is unique across nodes.
+    """
+    return f"{socket.gethostname()}_{os.getpid()}"
+
+
+def get_lease_path(pdb_id: str, stage: str) -> Path:
+    """
+    Return the path to the lease on this PDB for this stage.
+    """
+    # NOTE: leases are removed once their work finishes, so there are never enough to need sharding
+    return paths.LEASE_DIR / stage / f"{pdb_id}.lease"
+
+
+def is_lease_stale(lease_path: Path, lease_timeout: float) -> bool:
+    """
+    Has the lease gone unrenewed for longer than `lease_timeout` seconds, or been removed.
+    """
+    try:
+        return time.time() - lease_path.stat().st_mtime > lease_timeout
+    except FileNotFoundError:
+        return True
+
+
+def _create_lease(lease_path: Path) -> bool:
+    """
+    Atomically create a lease file naming this process as its owner, returning False if it already exists.
+    """
+    try:
+        descriptor = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(descriptor, mode="w", encoding="utf-8") as lease_file:
+        lease_file.write(get_owner())
+
+    return True
+
+
+def get_lease_owner(lease_path: Path) -> Optional[str]:
+    """
+    Return the owner named in a lease file, or None if there is no lease.
+    """
+    try:
+        return lease_path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def claim_lease(pdb_id: str, stage: str, lease_timeout: float = LEASE_TIMEOUT) -> bool:
+    """
+    Try to claim this PDB for a stage, returning True if this process now holds the lease.
+    """
+    lease_path = get_lease_path(pdb_id, stage)
+    lease_path.parent.mkdir(parents=True, exist_ok=True)
+    if _create_lease(lease_path):
+        return True
+    if not is_lease_stale(lease_path, lease_timeout):
+        return False
+
+    # only the node that creates the breaker may replace a stale lease, so two nodes never both take it over
+    breaker_path = lease_path.with_suffix(".break")
+    if not _create_lease(breaker_path):
+        if is_lease_stale(breaker_path, lease_timeout):
+            breaker_path.unlink(missing_ok=True)
+        return False
+
+    try:
+        if not is_lease_stale(lease_path, lease_timeout):
+            return False
+        lease_path.unlink(missing_ok=True)
+        return _create_lease(lease_path)
+    finally:
+        breaker_path.unlink(missing_ok=True)
+
+
+def release_lease(pdb_id: str, stage: str, owner: Optional[str] = None) -> None:
+    """
+    Release the lease on this PDB for a stage if `owner` (by default this process) still holds it.
+
+    A lease that went stale and was taken over by another process is left for its new owner.
+    """
+    lease_path = get_lease_path(pdb_id, stage)
+    if get_lease_owner(lease_path) == (owner or get_owner()):
+        lease_path.unlink(missing_ok=True)
+
+
+def release_dead_lease(pdb_id: str, stage: str) -> Optional[str]:
+    """
+    Release the lease on this PDB for a stage if its owner is a process on this node that has exited,
+    e.g. a worker that was killed part way through.  Returns the owner of the released lease, if any.
+    """
+    owner = get_lease_owner(get_lease_path(pdb_id, stage))
+    if owner is None:
+        return None
+
+    hostname, _, process_id = owner.rpartition("_")
+    if hostname != socket.gethostname() or not process_id.isdigit():
+        return None
+    try:
+        os.kill(int(process_id), 0)
+        return None
+    except (ProcessLookupError, PermissionError):
+        # NOTE: a PermissionError means the process ID now belongs to another user, so the owner has exited
+        release_lease(pdb_id, stage, owner)
+
+    return owner
+
+
+@contextmanager
+def hold_lease(
+    pdb_id: str, stage: str, lease_timeout: float = LEASE_TIMEOUT, renew_interval: float = LEASE_RENEW_INTERVAL
+) -> Iterator[bool]:
+    """
+    Try to claim this PDB for a stage for the enclosed block, yielding whether it was claimed.
+
+    A claimed lease is renewed every `renew_interval` seconds in the background, and released when the block exits.
+    """
+    if not claim_lease(pdb_id, stage, lease_timeout):
+        yield False
+        return
+
+    lease_path = get_lease_path(pdb_id, stage)
+    released = threading.Event()
+
+    def renew_lease() -> None:
+        while not released.wait(renew_interval):
+            # stop renewing a lease that was taken over after going stale, e.g. while this node was suspended
+            if get_lease_owner(lease_path) != get_owner():
+                return
+            try:
+                os.utime(lease_path)
+            except FileNotFoundError:
+                return
+
+    renewer = threading.Thread(target=renew_lease, daemon=True)
+    renewer.start()
+    try:
+        yield True
+    finally:
+        released.set()
+        renewer.join()
+        release_lease(pdb_id, stage)
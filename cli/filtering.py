@@ -0,0 +1,187 @@
+"""
+Functions for preparing PDBs and checking them against filtering metrics.
+"""
+
+
+from typing import Optional, Union
+
+import biotite.structure as bts
+
+from volumizer.pdb import clean_structure
+from cli import analysis, inventory, pdb, profiling, rcsb, structure_cache, utils
+from cli.constants import MAX_RESOLUTION
+
+
+def load_prepared_structure(pdb_id: str) -> bts.AtomArray:
+    """
+    Load the cleaned biological assembly of a PDB that has already been prepared,
+    from its memory-mapped structure array if one has been saved.
+    """
+    array_path = structure_cache.get_structure_array_path(pdb_id, "prepared")
+    if inventory.exists(array_path):
+        return structure_cache.load_structure_array(array_path)
+
+    prepared_structure = utils.load_stored_structure("prepared", pdb_id)
+    if structure_cache.are_structure_arrays_enabled():
+        with utils.atomic_output(array_path) as (partial_path,):
+            structure_cache.save_structure_array(prepared_structure, partial_path)
+
+    return prepared_structure
+
+
+def is_pdb_usable(pdb_id: str) -> bool:
+    """
+    Download a PDB if needed, and check it has a high enough resolution.
+    """
+    # a resolution on file lets us reject a PDB without downloading or reading it
+    resolution = utils.load_resolution(pdb_id)
+    if resolution is not None and resolution > MAX_RESOLUTION:
+        return False
+
+    if not utils.is_pdb_downloaded(pdb_id):
+        if not rcsb.download_pdb_file(pdb_id):
+            return False
+
+    if resolution is None:
+        with profiling.profile_stage("resolution", pdb_id):
+            resolution = rcsb.get_resolution(utils.get_downloaded_pdb_path(pdb_id))
+        if resolution is not None:
+            utils.save_resolution(pdb_id, resolution)
+        if resolution is not None and resolution > MAX_RESOLUTION:
+            return False
+
+    return True
+
+
+def get_prepared_structure(
+    pdb_id: str, preparation_metrics: Optional[dict[str, int]] = None
+) -> Optional[bts.AtomArray]:
+    """
+    Return the cleaned biological assembly of a PDB, preparing and saving it first if needed.
+
+    If `preparation_metrics` are given, the raw assembly must satisfy them before it is cleaned.
+    Returns None if the PDB cannot be downloaded, has too low a resolution, or is out of range.
+    """
+    if utils.is_pdb_prepared(pdb_id):
+        with profiling.profile_stage("load_prepared", pdb_id) as record:
+            prepared_structure = structure_cache.get_cached(pdb_id, "prepared", lambda: load_prepared_structure(pdb_id))
+            record["atoms"] = len(prepared_structure)
+        return prepared_structure
+
+    if not is_pdb_usable(pdb_id):
+        return None
+
+    # reject clearly out of range PDBs from the header before building the assembly
+    if preparation_metrics is not None:
+        with profiling.profile_stage("prescreen", pdb_id) as record:
+            size_estimate = rcsb.estimate_assembly_size_metrics(utils.get_downloaded_pdb_path(pdb_id))
+            record["atoms"] = None if size_estimate is None else size_estimate["atoms"]
+        if size_estimate is not None and not analysis.size_estimate_may_satisfy_metrics(
+            size_estimate, preparation_metrics
+        ):
+            return None
+
+    # early exit and don't clean if the PDB file is too big
+    with profiling.profile_stage("assembly", pdb_id) as record:
+        biological_assembly = rcsb.get_biological_assembly(pdb_id)
+        record["atoms"] = len(biological_assembly)
+    if preparation_metrics is not None:
+        if not analysis.pdb_satisfies_metrics(pdb.get_pdb_size_metrics(biological_assembly), preparation_metrics):
+            return None
+
+    with profiling.profile_stage("clean", pdb_id) as record:
+        prepared_structure = clean_structure(biological_assembly)
+        record["atoms"] = len(biological_assembly)
+    with profiling.profile_stage("save_prepared", pdb_id) as record:
+        utils.save_stored_structure("prepared", pdb_id, prepared_structure)
+        record["atoms"] = len(prepared_structure)
+    if structure_cache.are_structure_arrays_enabled():
+        with utils.atomic_output(structure_cache.get_structure_array_path(pdb_id, "prepared")) as (partial_path,):
+            structure_cache.save_structure_array(prepared_structure, partial_path)
+
+    return structure_cache.get_cached(pdb_id, "prepared", lambda: prepared_structure)
+
+
+def get_prepared_subunit(pdb_id: str) -> Optional[tuple[bts.AtomArray, dict[str, int]]]:
+    """
+    Return the cleaned asymmetric unit of a PDB and how many copies of each chain its biological assembly has,
+    so per-chain metrics of a large homo-oligomer cost about as much as its monomer.
+
+    Returns None if the PDB cannot be downloaded or has too low a resolution.
+    """
+    if not is_pdb_usable(pdb_id):
+        return None
+
+    def prepare_subunit() -> tuple[bts.AtomArray, dict[str, int]]:
+        asymmetric_unit, chain_multiplicities = rcsb.get_asymmetric_unit(pdb_id)
+        return clean_structure(asymmetric_unit), chain_multiplicities
+
+    with profiling.profile_stage("prepare_subunit", pdb_id) as record:
+        prepared_subunit = structure_cache.get_cached(
+            pdb_id, "subunit", prepare_subunit, size=lambda prepared_subunit: len(prepared_subunit[0])
+        )
+        record["atoms"] = len(prepared_subunit[0])
+
+    return prepared_subunit
+
+
+def pdb_satisfies_filters(pdb_id: str, metrics: dict[str, Union[int, float, bool, None]]) -> bool:
+    """
+    Check a PDB against size, secondary structure, and stoichiometry cutoffs in a single pass.
+
+    Metrics already on file are checked before any structure is parsed, and the assembly is only
+    built if the size metrics are needed.  Criteria are checked cheapest first so we exit as early as possible.
+    """
+    size_metrics = utils.load_pdb_size_metrics(pdb_id)
+    if size_metrics is not None and not analysis.pdb_satisfies_metrics(size_metrics, metrics):
+        return False
+
+    secondary_structure = utils.load_secondary_structure(pdb_id)
+    if secondary_structure is not None and not analysis.pdb_satisfies_secondary_structure(
+        secondary_structure, metrics
+    ):
+        return False
+
+    stoichiometry = utils.load_stoichiometry(pdb_id)
+    if stoichiometry is not None and not analysis.pdb_satisfies_stoichiometry(stoichiometry, metrics):
+        return False
+
+    if size_metrics is not None and secondary_structure is not None and stoichiometry is not None:
+        return True
+
+    if size_metrics is None:
+        structure = get_prepared_structure(pdb_id, analysis.get_preparation_metrics(metrics))
+        if structure is None:
+            return False
+
+        with profiling.profile_stage("size_metrics", pdb_id) as record:
+            size_metrics = pdb.get_pdb_size_metrics(structure)
+            record["atoms"] = len(structure)
+        utils.save_pdb_size_metrics(pdb_id, size_metrics)
+        if not analysis.pdb_satisfies_metrics(size_metrics, metrics):
+            return False
+
+    # per-chain metrics only need the asymmetric unit and the number of copies of each chain
+    prepared_subunit = get_prepared_subunit(pdb_id)
+    if prepared_subunit is None:
+        return False
+    subunit, chain_multiplicities = prepared_subunit
+
+    if secondary_structure is None:
+        with profiling.profile_stage("secondary_structure", pdb_id) as record:
+            secondary_structure = pdb.get_secondary_structure(subunit, chain_multiplicities)
+            record["atoms"] = len(subunit)
+        utils.save_secondary_structure(pdb_id, secondary_structure)
+        if not analysis.pdb_satisfies_secondary_structure(secondary_structure, metrics):
+            return False
+
+    if stoichiometry is None:
+        with profiling.profile_stage("stoichiometry", pdb_id) as record:
+            stoichiometry = pdb.get_stoichiometry(subunit, chain_multiplicities=chain_multiplicities)
+            record["atoms"] = len(subunit)
+        utils.save_stoichiometry(pdb_id, stoichiometry)
+        if not analysis.pdb_satisfies_stoichiometry(stoichiometry, metrics):
+            return False
+
+    return True
+
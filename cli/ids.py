@@ -0,0 +1,129 @@
+"""
+Functions to read PDB IDs from ID lists and RCSB cluster files, normalizing each ID once on the way in.
+
+IDs are upper-cased and stripped of any entity (`_1`), chain, or resolution (`.2.0`) suffix.
+For cluster files every member of every cluster is kept in a compact, array-backed cluster map,
+so later stages can fall back to another member of a cluster when the first cannot be used.
+"""
+
+
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+import re
+
+import numpy as np
+
+from cli.constants import PDB_ID_LENGTH
+
+
+# a PDB ID, followed by the end of the token or a suffix separator, e.g. 4HHB, 4hhb_1, 4HHB.A or 4HHB.2.0
+PDB_ID_PATTERN = re.compile(rf"[0-9][0-9A-Za-z]{{{PDB_ID_LENGTH - 1}}}(?![0-9A-Za-z])")
+
+# (members, offsets): the IDs of all clusters one after another as fixed-width bytes,
+# and the start of each cluster in `members`, followed by the total number of members
+ClusterMap = tuple[np.ndarray, np.ndarray]
+
+
+def normalize_pdb_id(raw_id: str) -> Optional[str]:
+    """
+    Return the upper-case PDB ID at the start of an ID with any suffix, or None if it does not start with one.
+    """
+    match = PDB_ID_PATTERN.match(raw_id.strip())
+    if match is None:
+        return None
+
+    return match.group().upper()
+
+
+def iter_pdb_ids(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Lazily yield each distinct, normalized PDB ID from lines with one ID per line, in the order they first appear.
+
+    Only the first ID on each line is read, so for a cluster file this is the first member of each cluster.
+    """
+    seen_pdb_ids = set()
+    for line in lines:
+        pdb_id = normalize_pdb_id(line)
+        if pdb_id is not None and pdb_id not in seen_pdb_ids:
+            seen_pdb_ids.add(pdb_id)
+            yield pdb_id
+
+
+def read_id_file(id_path: Path) -> Iterator[str]:
+    """
+    Lazily yield each distinct, normalized PDB ID from an ID list or RCSB cluster file, see `iter_pdb_ids`.
+    """
+    with open(id_path, mode="r", encoding="utf-8") as id_file:
+        yield from iter_pdb_ids(id_file)
+
+
+def parse_cluster_lines(lines: Iterable[str]) -> ClusterMap:
+    """
+    Build the cluster map of the lines of an RCSB cluster file, with one cluster of
+    entity IDs per line.  Each PDB is kept once per cluster, in the order it first appears.
+    """
+    members: list[str] = []
+    offsets = [0]
+    for line in lines:
+        cluster_pdb_ids = dict.fromkeys(
+            pdb_id for entity_id in line.split() if (pdb_id := normalize_pdb_id(entity_id)) is not None
+        )
+        if len(cluster_pdb_ids) == 0:
+            continue
+
+        members.extend(cluster_pdb_ids)
+        offsets.append(len(members))
+
+    return np.array(members, dtype=f"S{PDB_ID_LENGTH}"), np.array(offsets, dtype=np.int64)
+
+
+def read_cluster_file(cluster_path: Path) -> ClusterMap:
+    """
+    Build the cluster map of an RCSB cluster file.
+    """
+    with open(cluster_path, mode="r", encoding="utf-8") as cluster_file:
+        return parse_cluster_lines(cluster_file)
+
+
+def iter_clusters(cluster_map: ClusterMap) -> Iterator[list[str]]:
+    """
+    Lazily yield the PDB IDs of each cluster, in order.
+    """
+    members, offsets = cluster_map
+    for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        yield [member.decode() for member in members[start:stop]]
+
+
+def get_representatives(cluster_map: ClusterMap) -> list[str]:
+    """
+    Return the distinct first members of the clusters, in order.
+    """
+    members, offsets = cluster_map
+
+    return list(dict.fromkeys(member.decode() for member in members[offsets[:-1]]))
+
+
+def select_representatives(cluster_map: ClusterMap, is_usable: Callable[[str], bool]) -> Iterator[Optional[str]]:
+    """
+    Lazily yield the first member of each cluster for which `is_usable` is True, or None if there is none,
+    so a cluster whose first member cannot be downloaded or has too low a resolution is still represented.
+    """
+    for cluster_pdb_ids in iter_clusters(cluster_map):
+        yield next((pdb_id for pdb_id in cluster_pdb_ids if is_usable(pdb_id)), None)
+
+
+def save_cluster_map(cluster_map: ClusterMap, cluster_map_path: Path) -> None:
+    """
+    Save a cluster map as a NumPy archive of its two arrays.
+    """
+    members, offsets = cluster_map
+    with open(cluster_map_path, mode="wb") as out_file:
+        np.savez(out_file, members=members, offsets=offsets)
+
+
+def load_cluster_map(cluster_map_path: Path) -> ClusterMap:
+    """
+    Load a cluster map saved with `save_cluster_map`.
+    """
+    with np.load(cluster_map_path) as cluster_map_arrays:
+        return cluster_map_arrays["members"], cluster_map_arrays["offsets"]
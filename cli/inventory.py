@@ -0,0 +1,145 @@
+"""
+A snapshot of which files each sharded data directory holds, so existence checks are set lookups
+rather than one stat call per file, which is slow on network filesystems.
+
+A snapshot is taken with one `os.scandir` per shard, and saved with the modification time of each
+shard directory.  Adding or removing a file changes its directory's modification time, so refreshing
+a snapshot only lists the shards that have changed since.  Files written through `utils.atomic_output`
+are added to this process's snapshot as they are moved into place.
+"""
+
+
+from pathlib import Path
+from typing import Iterable
+import json
+import os
+
+from cli import coordination, paths
+
+
+# data directory -> shard name -> (shard modification time in ns, file names)
+_SNAPSHOTS: dict[Path, dict[str, tuple[int, set[str]]]] = {}
+
+# snapshots are only saved by the process that started the run, never by the workers it forks
+_SAVING_PROCESS_ID = os.getpid()
+
+
+def get_snapshot_path(data_dir: Path) -> Path:
+    """
+    Return the path to the saved snapshot of a data directory.
+    """
+    return paths.INVENTORY_DIR / f"{data_dir.name}.json"
+
+
+def load_snapshot(data_dir: Path) -> dict[str, tuple[int, set[str]]]:
+    """
+    Load the saved snapshot of a data directory, which is empty if there is none.
+    """
+    snapshot_path = get_snapshot_path(data_dir)
+    try:
+        with open(snapshot_path, mode="r", encoding="utf-8") as in_file:
+            saved_snapshot = json.load(in_file)
+    except (OSError, ValueError):
+        return {}
+
+    return {shard: (mtime, set(file_names)) for shard, (mtime, file_names) in saved_snapshot.items()}
+
+
+def save_snapshot(data_dir: Path, snapshot: dict[str, tuple[int, set[str]]]) -> None:
+    """
+    Save the snapshot of a data directory, replacing any saved before.
+    """
+    snapshot_path = get_snapshot_path(data_dir)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+
+    partial_path = snapshot_path.with_name(f"{coordination.get_owner()}_{snapshot_path.name}")
+    with open(partial_path, mode="w", encoding="utf-8") as out_file:
+        json.dump({shard: [mtime, sorted(file_names)] for shard, (mtime, file_names) in snapshot.items()}, out_file)
+    os.replace(partial_path, snapshot_path)
+
+
+def refresh(data_dir: Path) -> dict[str, tuple[int, set[str]]]:
+    """
+    Bring the snapshot of a data directory up to date, listing only the shards that changed since it was taken.
+    """
+    snapshot = _SNAPSHOTS[data_dir] if data_dir in _SNAPSHOTS else load_snapshot(data_dir)
+    if not data_dir.is_dir():
+        _SNAPSHOTS[data_dir] = {}
+        return _SNAPSHOTS[data_dir]
+
+    refreshed_snapshot = {}
+    with os.scandir(data_dir) as shard_entries:
+        for shard_entry in shard_entries:
+            if not shard_entry.is_dir():
+                continue
+
+            mtime = shard_entry.stat().st_mtime_ns
+            if shard_entry.name in snapshot and snapshot[shard_entry.name][0] == mtime:
+                refreshed_snapshot[shard_entry.name] = snapshot[shard_entry.name]
+                continue
+
+            with os.scandir(shard_entry.path) as file_entries:
+                refreshed_snapshot[shard_entry.name] = (
+                    mtime,
+                    {file_entry.name for file_entry in file_entries if file_entry.is_file()},
+                )
+
+    # NOTE: compare modification times only, files recorded by this process are already on disk
+    shard_mtimes = {shard: mtime for shard, (mtime, _) in snapshot.items()}
+    refreshed_shard_mtimes = {shard: mtime for shard, (mtime, _) in refreshed_snapshot.items()}
+    if os.getpid() == _SAVING_PROCESS_ID and refreshed_shard_mtimes != shard_mtimes:
+        save_snapshot(data_dir, refreshed_snapshot)
+    _SNAPSHOTS[data_dir] = refreshed_snapshot
+
+    return refreshed_snapshot
+
+
+def prepare_workers(
+    data_dirs: Iterable[Path] = (
+        paths.DOWNLOADED_PDB_DIR,
+        paths.STRUCTURE_ARRAY_DIR,
+        paths.ANNOTATED_PDB_DIR,
+        paths.ANNOTATED_DF_DIR,
+    ),
+) -> None:
+    """
+    Refresh the snapshots of the data directories workers check, before forking them, so each worker
+    inherits the snapshots rather than loading and refreshing its own.
+    """
+    for data_dir in data_dirs:
+        refresh(data_dir)
+
+
+def exists(path: Path, confirm_missing: bool = True) -> bool:
+    """
+    Does this file in a sharded data directory exist.
+
+    The directory's snapshot is refreshed the first time it is checked in a process, unless it was
+    inherited from the process that forked this one (see `prepare_workers`).  Files in the
+    snapshot are taken to exist, and any other is confirmed missing with a stat, since another process
+    may have written it since, unless `confirm_missing` is False (e.g. straight after a refresh).
+    """
+    data_dir = path.parent.parent
+    snapshot = _SNAPSHOTS[data_dir] if data_dir in _SNAPSHOTS else refresh(data_dir)
+    if path.parent.name in snapshot and path.name in snapshot[path.parent.name][1]:
+        return True
+    if not confirm_missing or not path.is_file():
+        return False
+
+    record(path)
+    return True
+
+
+def record(path: Path) -> None:
+    """
+    Add a file that has just been written to this process's snapshot of its data directory, if there is one.
+    """
+    snapshot = _SNAPSHOTS.get(path.parent.parent)
+    if snapshot is None:
+        return
+
+    # NOTE: the shard's modification time is left as it was, so the next refresh still lists the shard
+    if path.parent.name in snapshot:
+        snapshot[path.parent.name][1].add(path.name)
+    else:
+        snapshot[path.parent.name] = (0, {path.name})
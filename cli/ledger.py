@@ -0,0 +1,256 @@
+"""
+A persistent ledger of per-PDB jobs, recording the status, timing, and errors of each
+pipeline stage, along with helpers to run jobs across worker processes.
+"""
+
+
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+import warnings
+
+from tqdm import tqdm
+
+from cli import coordination, inventory, paths, utils
+from cli.constants import ID_CHUNK_SIZE, PENDING_JOBS_PER_WORKER
+
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    pdb_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    seconds REAL,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (pdb_id, stage)
+)
+"""
+
+_CONNECTIONS: dict[tuple[int, int], sqlite3.Connection] = {}
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return this thread's connection to the job ledger, creating the table if needed.
+    """
+    connection_key = (os.getpid(), threading.get_ident())
+    if connection_key not in _CONNECTIONS:
+        connection = sqlite3.connect(paths.JOB_LEDGER_PATH, timeout=60.0)
+        connection.execute(f"PRAGMA journal_mode={coordination.get_journal_mode()}")
+        connection.execute(SCHEMA)
+        connection.commit()
+        _CONNECTIONS[connection_key] = connection
+
+    return _CONNECTIONS[connection_key]
+
+
+def start_job(pdb_id: str, stage: str) -> None:
+    """
+    Record that a stage has started for this PDB.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            "INSERT INTO jobs (pdb_id, stage, status, attempts, updated) VALUES (?, ?, 'running', 1, ?) "
+            "ON CONFLICT(pdb_id, stage) DO UPDATE SET "
+            "status='running', attempts=attempts+1, seconds=NULL, error=NULL, updated=excluded.updated",
+            [pdb_id, stage, time.time()],
+        )
+
+
+def finish_job(pdb_id: str, stage: str, status: str, seconds: float, error: Optional[str] = None) -> None:
+    """
+    Record the outcome of a stage for this PDB: "done", "skipped", or "failed".
+
+    The job is recorded even if its start never was, e.g. for a worker killed before it could record it.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            "INSERT INTO jobs (pdb_id, stage, status, attempts, seconds, error, updated) VALUES (?, ?, ?, 1, ?, ?, ?) "
+            "ON CONFLICT(pdb_id, stage) DO UPDATE SET "
+            "status=excluded.status, seconds=excluded.seconds, error=excluded.error, updated=excluded.updated",
+            [pdb_id, stage, status, seconds, error, time.time()],
+        )
+
+
+def record_done_jobs(pdb_ids: Iterable[str], stage: str) -> None:
+    """
+    Record a stage as done for PDBs whose outputs were found on file rather than made by a job,
+    e.g. from before the ledger existed.  No run time is recorded, so they do not skew cost estimates.
+    """
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT INTO jobs (pdb_id, stage, status, updated) VALUES (?, ?, 'done', ?) "
+            "ON CONFLICT(pdb_id, stage) DO UPDATE SET "
+            "status='done', seconds=NULL, error=NULL, updated=excluded.updated",
+            [(pdb_id, stage, time.time()) for pdb_id in pdb_ids],
+        )
+
+
+def get_job_ids(stage: str, statuses: tuple[str, ...] = ("done",)) -> set[str]:
+    """
+    Return the IDs of every PDB whose job for this stage has one of the given statuses, in one query.
+    """
+    rows = get_connection().execute(
+        f"SELECT pdb_id FROM jobs WHERE stage=? AND status IN ({', '.join(['?'] * len(statuses))})",
+        [stage, *statuses],
+    )
+
+    return {row[0] for row in rows}
+
+
+def get_job_seconds(stage: str, limit: int) -> dict[str, float]:
+    """
+    Return the run time in seconds of the `limit` most recently completed jobs for this stage.
+    """
+    rows = get_connection().execute(
+        "SELECT pdb_id, seconds FROM jobs WHERE stage=? AND status='done' AND seconds IS NOT NULL "
+        "ORDER BY updated DESC LIMIT ?",
+        [stage, limit],
+    )
+
+    return {row[0]: row[1] for row in rows}
+
+
+def is_job_done(pdb_id: str, stage: str) -> bool:
+    """
+    Has this stage been completed for this PDB.
+    """
+    row = get_connection().execute("SELECT status FROM jobs WHERE pdb_id=? AND stage=?", [pdb_id, stage]).fetchone()
+
+    return row is not None and row[0] == "done"
+
+
+def get_job_status(pdb_id: str, stage: str) -> Optional[tuple[str, float]]:
+    """
+    Return the status of this stage for this PDB and when it was last updated, or None if it has never run.
+    """
+    row = get_connection().execute(
+        "SELECT status, updated FROM jobs WHERE pdb_id=? AND stage=?", [pdb_id, stage]
+    ).fetchone()
+    if row is None:
+        return None
+
+    return row[0], row[1]
+
+
+def run_job(function: Callable[[str], T], pdb_id: str, stage: str) -> Optional[T]:
+    """
+    Run `function` on a PDB ID, recording it in the ledger.
+
+    A result of None is recorded as "skipped", and an exception as "failed" before it is re-raised.
+    """
+    start_job(pdb_id, stage)
+    start_time = time.perf_counter()
+    try:
+        result = function(pdb_id)
+    except Exception as error:
+        finish_job(pdb_id, stage, "failed", time.perf_counter() - start_time, repr(error))
+        raise
+
+    finish_job(pdb_id, stage, "skipped" if result is None else "done", time.perf_counter() - start_time)
+
+    return result
+
+
+def run_claimed_job(function: Callable[[str], T], pdb_id: str, stage: str, since: float) -> Optional[T]:
+    """
+    Run `function` on a PDB ID as in `run_job`, but only while holding the lease on it, and only if
+    no node has completed it, or finished it in any way since `since` (the start of this run).
+
+    Returns None without running anything otherwise, so nodes sharing a data directory never repeat work.
+    """
+    with coordination.hold_lease(pdb_id, stage) as claimed:
+        if not claimed:
+            return None
+
+        job_status = get_job_status(pdb_id, stage)
+        if job_status is not None:
+            status, updated = job_status
+            # a job left running is one whose node died, since its lease has been taken over
+            if status == "done" or (status != "running" and updated >= since):
+                return None
+
+        return run_job(function, pdb_id, stage)
+
+
+def run_isolated(function: Callable[[str], T], pdb_id: str, stage: Optional[str] = None) -> Optional[T]:
+    """
+    Run `function` on a single PDB ID, warning and returning None if it raises,
+    so that one bad PDB cannot take down a whole run.
+
+    If `stage` is given the job is recorded in the ledger.
+    """
+    try:
+        if stage is not None:
+            return run_job(function, pdb_id, stage)
+        return function(pdb_id)
+    except Exception as error:
+        warnings.warn(f"Failed on {pdb_id}: {error!r}")
+        return None
+
+
+def map_pdb_ids(
+    function: Callable[[str], T],
+    pdb_ids: Iterable[str],
+    jobs: int = 1,
+    stage: Optional[str] = None,
+    load_cached: Optional[Callable[[list[str]], dict[str, T]]] = None,
+) -> Iterator[tuple[str, Optional[T]]]:
+    """
+    Apply `function` to each PDB ID using `jobs` worker processes.
+
+    IDs are read lazily in chunks, and if given, `load_cached` is called once per chunk to look up
+    results already on file, which are yielded without calling `function`.
+    Yields (PDB ID, result) pairs as they complete, in no particular order, with a single progress bar.
+    At most `jobs * PENDING_JOBS_PER_WORKER` IDs are queued at once, so memory use does not grow
+    with the number of IDs.  The result is None for any PDB ID where `function` raised.
+    """
+    isolated_function = partial(run_isolated, function, stage=stage)
+    completed_jobs: queue.SimpleQueue = queue.SimpleQueue()
+    pending_jobs = 0
+
+    if jobs > 1:
+        inventory.prepare_workers()
+    pool_context = multiprocessing.Pool(processes=jobs) if jobs > 1 else nullcontext()
+    with pool_context as pool, tqdm(unit="PDB") as progress:
+        for pdb_id_chunk in utils.iter_chunks(pdb_ids, ID_CHUNK_SIZE):
+            cached_results = {} if load_cached is None else load_cached(pdb_id_chunk)
+            for pdb_id in pdb_id_chunk:
+                if pdb_id in cached_results:
+                    progress.update()
+                    yield pdb_id, cached_results[pdb_id]
+                elif pool is None:
+                    result = isolated_function(pdb_id)
+                    progress.update()
+                    yield pdb_id, result
+                else:
+                    while pending_jobs >= jobs * PENDING_JOBS_PER_WORKER:
+                        pending_jobs -= 1
+                        progress.update()
+                        yield completed_jobs.get()
+
+                    pool.apply_async(
+                        isolated_function,
+                        (pdb_id,),
+                        callback=lambda result, pdb_id=pdb_id: completed_jobs.put((pdb_id, result)),
+                        error_callback=lambda error, pdb_id=pdb_id: completed_jobs.put((pdb_id, None)),
+                    )
+                    pending_jobs += 1
+
+        while pending_jobs > 0:
+            pending_jobs -= 1
+            progress.update()
+            yield completed_jobs.get()
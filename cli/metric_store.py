@@ -0,0 +1,167 @@
+"""
+A single SQLite table holding the filtering metrics of every PDB, keyed by PDB ID.
+"""
+
+
+from pathlib import Path
+from typing import Any, Iterable, Optional
+import json
+import os
+import sqlite3
+import threading
+
+from tqdm import tqdm
+
+from cli import coordination, paths
+
+
+SIZE_COLUMNS = ("atoms", "residues", "chains")
+STOICHIOMETRY_COLUMNS = ("stoichiometry",)
+SECONDARY_STRUCTURE_COLUMNS = ("helix", "strand", "coil")
+RESOLUTION_COLUMNS = ("resolution",)
+
+# stay under SQLite's default limit on the number of parameters in one query
+MAX_QUERY_IDS = 900
+
+# stoichiometry is a variable length mapping, so it is stored as JSON text
+JSON_COLUMNS = frozenset(STOICHIOMETRY_COLUMNS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    pdb_id TEXT PRIMARY KEY,
+    resolution REAL,
+    atoms INTEGER,
+    residues INTEGER,
+    chains INTEGER,
+    stoichiometry TEXT,
+    helix REAL,
+    strand REAL,
+    coil REAL
+)
+"""
+
+_CONNECTIONS: dict[tuple[int, int], sqlite3.Connection] = {}
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return this thread's connection to the metric store, creating the table if needed.
+
+    Connections are never shared across processes, and WAL mode lets worker processes
+    append concurrently while others read (unless the data directory is shared between nodes).
+    """
+    connection_key = (os.getpid(), threading.get_ident())
+    if connection_key not in _CONNECTIONS:
+        connection = sqlite3.connect(paths.METRIC_STORE_PATH, timeout=60.0)
+        connection.execute(f"PRAGMA journal_mode={coordination.get_journal_mode()}")
+        connection.execute(SCHEMA)
+        connection.commit()
+        _CONNECTIONS[connection_key] = connection
+
+    return _CONNECTIONS[connection_key]
+
+
+def _decode_row(row: tuple, columns: tuple[str, ...]) -> dict[str, Any]:
+    """
+    Convert a row from the store into a dictionary of metrics.
+    """
+    return {
+        column: json.loads(value) if column in JSON_COLUMNS else value for column, value in zip(columns, row)
+    }
+
+
+def _upsert_metrics(connection: sqlite3.Connection, pdb_id: str, metrics: dict[str, Any]) -> None:
+    """
+    Insert or update the given metric columns for a PDB, leaving other columns untouched.
+    """
+    columns = list(metrics.keys())
+    values = [json.dumps(metrics[column]) if column in JSON_COLUMNS else metrics[column] for column in columns]
+    placeholders = ", ".join(["?"] * (len(columns) + 1))
+    updates = ", ".join([f"{column}=excluded.{column}" for column in columns])
+
+    connection.execute(
+        f"INSERT INTO metrics (pdb_id, {', '.join(columns)}) VALUES ({placeholders}) "
+        f"ON CONFLICT(pdb_id) DO UPDATE SET {updates}",
+        [pdb_id, *values],
+    )
+
+
+def save_metrics(pdb_id: str, metrics: dict[str, Any]) -> None:
+    """
+    Save the given metric columns for a PDB in a single transaction.
+    """
+    connection = get_connection()
+    with connection:
+        _upsert_metrics(connection, pdb_id, metrics)
+
+
+def load_metrics(pdb_id: str, columns: tuple[str, ...]) -> Optional[dict[str, Any]]:
+    """
+    Load the given metric columns for a PDB, or None if any of them have not been recorded.
+    """
+    row = (
+        get_connection()
+        .execute(f"SELECT {', '.join(columns)} FROM metrics WHERE pdb_id = ?", [pdb_id])
+        .fetchone()
+    )
+    if row is None or None in row:
+        return None
+
+    return _decode_row(row, columns)
+
+
+def load_all_metrics(
+    columns: tuple[str, ...], pdb_ids: Optional[Iterable[str]] = None
+) -> dict[str, dict[str, Any]]:
+    """
+    Load the given metric columns for every PDB that has all of them recorded, in one query.
+
+    If `pdb_ids` are given only those PDBs are loaded, in one query per `MAX_QUERY_IDS` IDs.
+    """
+    conditions = " AND ".join([f"{column} IS NOT NULL" for column in columns])
+    query = f"SELECT pdb_id, {', '.join(columns)} FROM metrics WHERE {conditions}"
+    connection = get_connection()
+    if pdb_ids is None:
+        return {row[0]: _decode_row(row[1:], columns) for row in connection.execute(query)}
+
+    pdb_ids = list(pdb_ids)
+    metrics = {}
+    for start in range(0, len(pdb_ids), MAX_QUERY_IDS):
+        query_ids = pdb_ids[start : start + MAX_QUERY_IDS]
+        rows = connection.execute(f"{query} AND pdb_id IN ({', '.join(['?'] * len(query_ids))})", query_ids)
+        metrics.update({row[0]: _decode_row(row[1:], columns) for row in rows})
+
+    return metrics
+
+
+def migrate_json_metrics(metric_dir: Path = paths.PDB_FILTERING_METRIC_DIR) -> dict[str, int]:
+    """
+    Copy the per-PDB JSON metric files from `metric_dir` into the metric store.
+
+    Returns the number of files migrated for each kind of metric.
+    """
+    file_kinds: dict[str, tuple[str, ...]] = {
+        "size": SIZE_COLUMNS,
+        "stoichiometry": STOICHIOMETRY_COLUMNS,
+        "secondary_structure": SECONDARY_STRUCTURE_COLUMNS,
+    }
+    migrated = {kind: 0 for kind in file_kinds}
+
+    connection = get_connection()
+    with connection:
+        for metric_path in tqdm(list(metric_dir.glob("*.json")), desc="Migrating metrics"):
+            pdb_id, _, kind = metric_path.stem.partition("_")
+            if kind not in file_kinds:
+                continue
+
+            with open(metric_path, mode="r", encoding="utf-8") as in_file:
+                metrics = json.load(in_file)
+            if metrics is None:
+                continue
+
+            if kind == "stoichiometry":
+                metrics = {"stoichiometry": metrics}
+            _upsert_metrics(connection, pdb_id, {column: metrics[column] for column in file_kinds[kind]})
+            migrated[kind] += 1
+
+    return migrated
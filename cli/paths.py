@@ -3,15 +3,34 @@ Define project paths.
 """
 
 from pathlib import Path
+import os
 
 
+DATA_DIR_ENV_VAR = "VOLUMIZER_CLI_DATA_DIR"
+
 ROOT_DIR = Path(__file__).resolve().parents[1]
 
-DATA_DIR = ROOT_DIR / "data"
-TEST_DIR = DATA_DIR / "tests"
+# files shipped with the package stay in the checkout, everything generated goes under the data root,
+# which may be moved (e.g. to storage shared between nodes) with the VOLUMIZER_CLI_DATA_DIR environment variable
+PACKAGE_DATA_DIR = ROOT_DIR / "data"
+TEST_DIR = PACKAGE_DATA_DIR / "tests"
+TEST_DATA_DIR = PACKAGE_DATA_DIR / "test_data"
+RCSB_CLUSTER_DIR = PACKAGE_DATA_DIR / "rcsb_clusters"
+
+DATA_DIR = Path(os.environ.get(DATA_DIR_ENV_VAR, PACKAGE_DATA_DIR)).expanduser().resolve()
+BENCHMARK_DIR = DATA_DIR / "benchmarks"
 
 DOWNLOADED_PDB_DIR = DATA_DIR / "downloaded_pdbs"
 PREPARED_PDB_DIR = DATA_DIR / "prepared_pdbs"
 ANNOTATED_PDB_DIR = DATA_DIR / "annotated_pdbs"
 ANNOTATED_DF_DIR = DATA_DIR / "annotated_dfs"
+ANNOTATION_INDEX_DIR = DATA_DIR / "annotation_index"
 PDB_FILTERING_METRIC_DIR = DATA_DIR / "pdb_filter_metrics"
+METRIC_STORE_PATH = DATA_DIR / "pdb_filter_metrics.sqlite"
+JOB_LEDGER_PATH = DATA_DIR / "job_ledger.sqlite"
+PROFILE_DIR = DATA_DIR / "profiles"
+PARTIAL_DIR = DATA_DIR / "partial"
+STRUCTURE_ARRAY_DIR = DATA_DIR / "structure_arrays"
+DATA_LAYOUT_PATH = DATA_DIR / "layout.json"
+LEASE_DIR = DATA_DIR / "leases"
+INVENTORY_DIR = DATA_DIR / "inventory"
@@ -2,6 +2,10 @@
 Functions for parsing, cleaning, and modifying PDBs.
 """
 
+from functools import cache, lru_cache
+from typing import Optional
+
+import numpy as np
 import biotite.structure as bts
 from biotite.sequence import ProteinSequence
 from biotite.sequence.align import SubstitutionMatrix, align_optimal
@@ -10,6 +14,7 @@ from cli.constants import (
     RESIDUE_LETTER_CONVERSION,
     SEQUENCE_IDENTITY_CUTOFF,
     BIOTITE_SSE_CODES,
+    SEQUENCE_CACHE_SIZE,
 )
 
 
@@ -24,49 +29,199 @@ def get_pdb_size_metrics(structure: bts.AtomArray) -> dict[str, int]:
     }
 
 
-def get_stoichiometry(structure: bts.AtomArray, match_cutoff: float = SEQUENCE_IDENTITY_CUTOFF) -> dict[int, int]:
+@cache
+def get_substitution_matrix() -> SubstitutionMatrix:
+    """
+    Return the standard protein substitution matrix, built once per process.
+    """
+    return SubstitutionMatrix.std_protein_matrix()
+
+
+@lru_cache(maxsize=SEQUENCE_CACHE_SIZE)
+def get_protein_sequence(sequence: str) -> ProteinSequence:
+    """
+    Return the sequence object for a one-letter sequence, reusing it across alignments.
+    """
+    return ProteinSequence(sequence)
+
+
+def get_chain_sequences(structure: bts.AtomArray) -> list[str]:
+    """
+    Return the one-letter sequence of each chain, in the order the chains appear.
+    """
+    if len(structure) == 0:
+        return []
+
+    chain_starts = bts.get_chain_starts(structure)
+    residue_starts = np.union1d(bts.get_residue_starts(structure), chain_starts)
+
+    # convert each distinct residue name once, then broadcast to every residue
+    residue_names, residue_name_indices = np.unique(structure.res_name[residue_starts], return_inverse=True)
+    residue_letters = np.array(
+        [RESIDUE_LETTER_CONVERSION.get(residue_name, "X") for residue_name in residue_names]
+    )[residue_name_indices]
+
+    chain_boundaries = np.searchsorted(residue_starts, chain_starts[1:])
+    return ["".join(chain_letters) for chain_letters in np.split(residue_letters, chain_boundaries)]
+
+
+def get_chain_copies(structure: bts.AtomArray, chain_multiplicities: Optional[dict[str, int]] = None) -> np.ndarray:
+    """
+    Return how many copies of each chain, in the order the chains appear, to count.
+
+    Every chain is counted once unless `chain_multiplicities` gives the number of copies of each chain ID,
+    as for an asymmetric unit standing in for its biological assembly.  Chains without a multiplicity are not counted.
+    """
+    chain_ids = structure.chain_id[bts.get_chain_starts(structure)]
+    if chain_multiplicities is None:
+        return np.ones(len(chain_ids), dtype=int)
+
+    return np.array([chain_multiplicities.get(chain_id, 0) for chain_id in chain_ids], dtype=int)
+
+
+def get_alignment_identity(query_sequence: str, reference_sequence: str) -> float:
+    """
+    Align two sequences and return the fraction of alignment positions covered by the reference.
+    """
+    alignment = align_optimal(
+        get_protein_sequence(query_sequence),
+        get_protein_sequence(reference_sequence),
+        get_substitution_matrix(),
+        max_number=1,
+    )
+    trace = alignment[0].trace
+    return np.count_nonzero(trace[:, -1] != -1) / trace.shape[0]
+
+
+def bound_alignment_identity(query_sequence: str, reference_sequence: str, match_cutoff: float) -> Optional[bool]:
+    """
+    Decide whether two sequences match using only their lengths, if possible.
+
+    Every reference residue appears exactly once in a global alignment, so the identity is
+    len(reference) / len(alignment), and the alignment length lies between the longer sequence
+    length and the sum of both lengths.
+
+    Returns True or False if the bounds decide the match, None if an alignment is needed.
+    """
+    query_length = len(query_sequence)
+    reference_length = len(reference_sequence)
+
+    if reference_length / max(query_length, reference_length) < match_cutoff:
+        return False
+    if reference_length / (query_length + reference_length) >= match_cutoff:
+        return True
+
+    return None
+
+
+def get_stoichiometry(
+    structure: bts.AtomArray,
+    match_cutoff: float = SEQUENCE_IDENTITY_CUTOFF,
+    chain_multiplicities: Optional[dict[str, int]] = None,
+) -> dict[int, int]:
     """
     Example return = {1: 10, 2: 5} for a heteromultimer with 10 of one chain and 5 of the other
+
+    If `chain_multiplicities` are given each chain counts that many times, see `get_chain_copies`.
     """
-    sequences = []
-    for chain in bts.chain_iter(structure):
-        sequence = "".join([RESIDUE_LETTER_CONVERSION.get(residue.res_name[0], "X") for residue in bts.residue_iter(chain)])
-        sequences.append(sequence)
+    chain_sequences = get_chain_sequences(structure)
+    chain_copies = get_chain_copies(structure, chain_multiplicities)
 
-    # compute pairwise sequence identity using biopython to assign sequence clusters
+    return get_sequence_stoichiometry(
+        [
+            chain_sequence
+            for chain_sequence, copies in zip(chain_sequences, chain_copies.tolist())
+            for _ in range(copies)
+        ],
+        match_cutoff,
+    )
+
+
+def get_sequence_stoichiometry(
+    chain_sequences: list[str], match_cutoff: float = SEQUENCE_IDENTITY_CUTOFF
+) -> dict[int, int]:
+    """
+    Cluster chain sequences by pairwise alignment and return the size of each cluster.
+    """
+    sequences = list(chain_sequences)
+
+    # assign sequence clusters by pairwise alignment against each cluster's first sequence
+    # NOTE: identical sequences always land in the same cluster, so each unique sequence is only placed once
     cluster_count = 0
-    clusters = {cluster_count: [sequences.pop()]}
+    cluster_representatives = {cluster_count: sequences[-1]}
+    cluster_sizes = {cluster_count: 0}
+    sequence_clusters = {sequences[-1]: cluster_count}
     while len(sequences) > 0:
         query_sequence = sequences.pop()
+        if query_sequence in sequence_clusters:
+            cluster_sizes[sequence_clusters[query_sequence]] += 1
+            continue
+
         joined_cluster = False
-        for cluster_id, cluster_sequences in clusters.items():
-            alignment = align_optimal(ProteinSequence(query_sequence), ProteinSequence(cluster_sequences[0]), SubstitutionMatrix.std_protein_matrix(), max_number=1)
-            identity = sum([1 for position in alignment[0].trace if position[-1] != -1]) / alignment[0].trace.shape[0]
+        for cluster_id, representative_sequence in cluster_representatives.items():
+            is_match = bound_alignment_identity(query_sequence, representative_sequence, match_cutoff)
+            if is_match is None:
+                is_match = get_alignment_identity(query_sequence, representative_sequence) >= match_cutoff
 
             # if this is a match, add it to this cluster
-            if identity >= match_cutoff:
-                clusters[cluster_id].append(query_sequence)
+            if is_match:
+                sequence_clusters[query_sequence] = cluster_id
+                cluster_sizes[cluster_id] += 1
                 joined_cluster = True
                 break
 
         # if we don't find any matches, start a new cluster
         if not joined_cluster:
             cluster_count += 1
-            clusters[cluster_count] = [query_sequence]
+            cluster_representatives[cluster_count] = query_sequence
+            cluster_sizes[cluster_count] = 1
+            sequence_clusters[query_sequence] = cluster_count
 
     # compute the stoichiometry
-    return {cluster_id: len(cluster_sequences) for cluster_id, cluster_sequences in clusters.items()}
+    return cluster_sizes
 
 
-def get_secondary_structure(structure: bts.AtomArray) -> dict[str, float]:
+def count_secondary_structure(sse: np.ndarray) -> np.ndarray:
+    """
+    Count the helix, strand, and all residues with a secondary structure assigned, in that order.
+    """
+    return np.array(
+        [
+            np.count_nonzero(np.isin(sse, list(BIOTITE_SSE_CODES["helix"]))),
+            np.count_nonzero(np.isin(sse, list(BIOTITE_SSE_CODES["strand"]))),
+            np.count_nonzero(sse != ""),
+        ]
+    )
+
+
+def get_secondary_structure(
+    structure: bts.AtomArray, chain_multiplicities: Optional[dict[str, int]] = None
+) -> dict[str, float]:
     """
     Compute the fraction of basic secondary structures, helix, strand, loop
+
+    If `chain_multiplicities` are given each chain counts that many times, see `get_chain_copies`.
     """
-    sse = bts.annotate_sse(structure)
+    # identical chains, as in a homo-oligomer, have near-identical secondary structure,
+    # so each unique chain sequence is only annotated once and counted for every copy
+    chain_starts = bts.get_chain_starts(structure, add_exclusive_stop=True)
+    sequence_counts: dict[str, np.ndarray] = {}
+    sse_counts = np.zeros(3, dtype=int)
+    for chain_sequence, copies, chain_start, chain_stop in zip(
+        get_chain_sequences(structure),
+        get_chain_copies(structure, chain_multiplicities).tolist(),
+        chain_starts[:-1],
+        chain_starts[1:],
+    ):
+        if copies == 0:
+            continue
+        if chain_sequence not in sequence_counts:
+            sequence_counts[chain_sequence] = count_secondary_structure(
+                bts.annotate_sse(structure[chain_start:chain_stop])
+            )
+        sse_counts += copies * sequence_counts[chain_sequence]
 
-    helix_residues = len([res for res in sse if res in BIOTITE_SSE_CODES["helix"]])
-    strand_residues = len([res for res in sse if res in BIOTITE_SSE_CODES["strand"]])
-    total_sse_residues = len([res for res in sse if res != ""])
+    helix_residues, strand_residues, total_sse_residues = sse_counts.tolist()
 
     if total_sse_residues == 0:
         return {
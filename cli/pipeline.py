@@ -0,0 +1,381 @@
+"""
+Overlap downloading PDBs with computing on them, so the network is never idle while the CPUs work and vice versa.
+
+An asyncio event loop in a background thread reads the IDs, looks up any results already on file, and downloads
+the rest over many concurrent connections, handing each ID on through a bounded queue once its file is on disk.
+When computation falls behind the queue fills up and downloads pause until there is room again.
+
+The download stage runs in a process of its own, so workers can be forked while downloads are under way
+without inheriting a lock held by a download thread.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+import warnings
+
+from tqdm import tqdm
+
+from cli import inventory, ledger, rcsb, utils
+from cli.constants import (
+    ID_CHUNK_SIZE,
+    PENDING_JOBS_PER_WORKER,
+    PIPELINE_QUEUE_PER_WORKER,
+    RCSB_MMTF_URL,
+    DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_BACKOFF,
+)
+
+
+T = TypeVar("T")
+
+
+def _run_download_stage(
+    pdb_ids: Iterable[str],
+    load_cached: Optional[Callable[[list[str]], dict[str, Any]]],
+    ready: queue.Queue,
+    stopped: threading.Event,
+    stats: dict[str, float],
+    connections: int,
+    url: str,
+) -> None:
+    """
+    Background thread entry-point: put ("cached", PDB ID, result) on `ready` for each ID with a result on file,
+    and ("ready", PDB ID, None) for every other ID once its download has finished or failed.
+    Ends with ("end", None, None), or ("error", None, exception) if the stage itself fails.
+    """
+
+    async def put_ready(message: tuple[str, Optional[str], Any]) -> None:
+        # wait for room in a thread, so a full queue pauses this stage without blocking the event loop
+        while not stopped.is_set():
+            try:
+                await asyncio.to_thread(ready.put, message, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    async def run_stage() -> None:
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=connections + 1))
+        to_download: asyncio.Queue = asyncio.Queue(maxsize=connections)
+
+        async def reader() -> None:
+            try:
+                for pdb_id_chunk in utils.iter_chunks(pdb_ids, ID_CHUNK_SIZE):
+                    cached_results = {} if load_cached is None else load_cached(pdb_id_chunk)
+                    for pdb_id in pdb_id_chunk:
+                        # stop reading IDs (and looking up their results) as soon as the caller is done
+                        if stopped.is_set():
+                            return
+                        stats["read"] += 1
+                        if pdb_id in cached_results:
+                            stats["on_file"] += 1
+                            await put_ready(("cached", pdb_id, cached_results[pdb_id]))
+                        else:
+                            await to_download.put(pdb_id)
+            finally:
+                for _ in range(connections):
+                    await to_download.put(None)
+
+        async def downloader() -> None:
+            while (pdb_id := await to_download.get()) is not None:
+                if stopped.is_set():
+                    continue
+                status, num_bytes = await rcsb.download_pdb_file_async(
+                    pdb_id, url, DOWNLOAD_RETRIES, DOWNLOAD_BACKOFF
+                )
+                stats[status] += 1
+                stats["bytes"] += num_bytes
+                # failed downloads are passed on too, so they are recorded like any other failure
+                await put_ready(("ready", pdb_id, None))
+
+        await asyncio.gather(reader(), *[downloader() for _ in range(connections)])
+
+    try:
+        asyncio.run(run_stage())
+        ready.put(("end", None, None))
+    except Exception as error:
+        ready.put(("error", None, error))
+
+
+@contextmanager
+def run_download_stage(
+    pdb_ids: Iterable[str],
+    queue_size: int,
+    load_cached: Optional[Callable[[list[str]], dict[str, Any]]] = None,
+    connections: int = DOWNLOAD_CONNECTIONS,
+    url: str = RCSB_MMTF_URL,
+) -> Iterator[tuple[queue.Queue, dict[str, float]]]:
+    """
+    Run the download stage in a background thread for the enclosed block, yielding the queue of messages
+    it produces (see `_run_download_stage`), which holds at most `queue_size`, and its running counts.
+    """
+    ready: queue.Queue = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    stats = {
+        "start_time": time.perf_counter(),
+        "read": 0,
+        "on_file": 0,
+        "cached": 0,
+        "downloaded": 0,
+        "failed": 0,
+        "bytes": 0,
+        "computed": 0,
+    }
+    download_stage = threading.Thread(
+        target=_run_download_stage,
+        args=(pdb_ids, load_cached, ready, stopped, stats, connections, url),
+        daemon=True,
+    )
+    download_stage.start()
+    try:
+        yield ready, stats
+    finally:
+        # if the block exits early, empty the queue so the stage can see it should stop
+        stopped.set()
+        while download_stage.is_alive():
+            try:
+                ready.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _run_download_process(
+    pdb_ids: Iterable[str],
+    load_cached: Optional[Callable[[list[str]], dict[str, Any]]],
+    messages: multiprocessing.Queue,
+    connections: int,
+    url: str,
+) -> None:
+    """
+    Download process entry-point: run the download stage, passing each of its messages on to `messages`
+    along with the stage's running counts.
+    """
+    with run_download_stage(pdb_ids, 1, load_cached, connections, url) as (ready, stats):
+        while True:
+            kind, pdb_id, detail = ready.get()
+            messages.put((kind, pdb_id, detail, {name: count for name, count in stats.items() if name != "computed"}))
+            if kind in ("end", "error"):
+                return
+
+
+@contextmanager
+def run_download_process(
+    pdb_ids: Iterable[str],
+    queue_size: int,
+    load_cached: Optional[Callable[[list[str]], dict[str, Any]]] = None,
+    connections: int = DOWNLOAD_CONNECTIONS,
+    url: str = RCSB_MMTF_URL,
+) -> Iterator[tuple[Callable[[], tuple[str, Optional[str], Any]], multiprocessing.Queue, dict[str, float]]]:
+    """
+    Run the download stage as `run_download_stage` does, but in a separate process, which must be started
+    before any other thread or process, so that workers can be forked while downloads are under way.
+
+    Yields a function returning the next message of the stage, the queue of messages, which holds
+    at most `queue_size`, and the stage's running counts, which are updated as messages are taken.
+    """
+    messages: multiprocessing.Queue = multiprocessing.Queue(maxsize=queue_size)
+    stats = {
+        "start_time": time.perf_counter(),
+        "read": 0,
+        "on_file": 0,
+        "cached": 0,
+        "downloaded": 0,
+        "failed": 0,
+        "bytes": 0,
+        "computed": 0,
+    }
+    download_process = multiprocessing.Process(
+        target=_run_download_process, args=(pdb_ids, load_cached, messages, connections, url), daemon=True
+    )
+    download_process.start()
+
+    def get_message() -> tuple[str, Optional[str], Any]:
+        kind, pdb_id, detail, download_stats = messages.get()
+        # NOTE: keep this process's start time, the counts are only compared against it
+        stats.update({name: count for name, count in download_stats.items() if name != "start_time"})
+        return kind, pdb_id, detail
+
+    try:
+        yield get_message, messages, stats
+    finally:
+        download_process.terminate()
+        download_process.join()
+
+
+def get_pipeline_status(stats: dict[str, float], ready: queue.Queue, pending_jobs: int = 0) -> dict[str, str]:
+    """
+    Return the queue depth and throughput of each stage, for display alongside a progress bar.
+    """
+    seconds = max(time.perf_counter() - stats["start_time"], 1e-6)
+
+    return {
+        "download": f"{(stats['downloaded'] + stats['cached']) / seconds:.1f}/s",
+        "MB/s": f"{stats['bytes'] / seconds / 1e6:.2f}",
+        "queued": str(ready.qsize()),
+        "computing": str(pending_jobs),
+        "compute": f"{stats['computed'] / seconds:.1f}/s",
+    }
+
+
+def summarize_pipeline(stats: dict[str, float]) -> str:
+    """
+    Summarize what each stage got through over the whole run.
+    """
+    seconds = max(time.perf_counter() - stats["start_time"], 1e-6)
+
+    return (
+        f"Read {stats['read']} PDB IDs in {seconds:.1f} s: {stats['on_file']} already had results on file, "
+        f"{stats['downloaded']} downloaded ({stats['bytes'] / seconds / 1e6:.2f} MB/s), "
+        f"{stats['cached']} already downloaded, {stats['failed']} failed to download, "
+        f"and {stats['computed']} computed ({stats['computed'] / seconds:.1f}/s)"
+    )
+
+
+def map_pdb_ids_pipelined(
+    function: Callable[[str], T],
+    pdb_ids: Iterable[str],
+    jobs: int = 1,
+    stage: Optional[str] = None,
+    load_cached: Optional[Callable[[list[str]], dict[str, T]]] = None,
+    connections: int = DOWNLOAD_CONNECTIONS,
+    url: str = RCSB_MMTF_URL,
+) -> Iterator[tuple[str, Optional[T]]]:
+    """
+    Apply `function` to each PDB ID as `ledger.map_pdb_ids` does, while downloading the upcoming PDBs
+    over `connections` concurrent connections, or one at a time within `function` if `connections` is 0.
+
+    At most `jobs * PIPELINE_QUEUE_PER_WORKER` downloaded PDBs wait for a worker, and the progress bar
+    shows the queue depth and throughput of each stage.
+    """
+    if connections == 0:
+        yield from ledger.map_pdb_ids(function, pdb_ids, jobs, stage, load_cached)
+        return
+
+    isolated_function = partial(ledger.run_isolated, function, stage=stage)
+    completed_jobs: queue.SimpleQueue = queue.SimpleQueue()
+    pending_jobs = 0
+
+    if jobs > 1:
+        inventory.prepare_workers()
+    # NOTE: the pool replaces any worker that dies by forking again, so downloads run in their own process,
+    # which is started first so that it is not forked from a process running the pool's threads
+    download_stage = run_download_process(pdb_ids, jobs * PIPELINE_QUEUE_PER_WORKER, load_cached, connections, url)
+    with download_stage as (get_message, ready, stats), (
+        multiprocessing.Pool(processes=jobs) if jobs > 1 else nullcontext()
+    ) as pool, tqdm(unit="PDB") as progress:
+
+        def complete(pdb_id: str, result: Optional[T]) -> tuple[str, Optional[T]]:
+            stats["computed"] += 1
+            progress.set_postfix(get_pipeline_status(stats, ready, pending_jobs), refresh=False)
+            progress.update()
+            return pdb_id, result
+
+        while True:
+            # hand back whatever has completed before waiting on the download stage
+            while pending_jobs > 0 and not completed_jobs.empty():
+                pending_jobs -= 1
+                yield complete(*completed_jobs.get())
+
+            kind, pdb_id, detail = get_message()
+            if kind == "end":
+                break
+            if kind == "error":
+                raise detail
+
+            if kind == "cached":
+                progress.update()
+                yield pdb_id, detail
+            elif pool is None:
+                yield complete(pdb_id, isolated_function(pdb_id))
+            else:
+                while pending_jobs >= jobs * PENDING_JOBS_PER_WORKER:
+                    pending_jobs -= 1
+                    yield complete(*completed_jobs.get())
+
+                pool.apply_async(
+                    isolated_function,
+                    (pdb_id,),
+                    callback=lambda result, pdb_id=pdb_id: completed_jobs.put((pdb_id, result)),
+                    error_callback=lambda error, pdb_id=pdb_id: completed_jobs.put((pdb_id, None)),
+                )
+                pending_jobs += 1
+
+        while pending_jobs > 0:
+            pending_jobs -= 1
+            yield complete(*completed_jobs.get())
+
+    print(summarize_pipeline(stats))
+
+
+def _run_prefetch_stage(
+    pdb_ids: list[str],
+    lookahead: int,
+    connections: int,
+    url: str,
+    finished: Any,
+    statuses: multiprocessing.Queue,
+) -> None:
+    """
+    Prefetch process entry-point: run the download stage, taking one PDB off its queue each time
+    `finished` is released, and report the stage's status after each.  Runs until terminated.
+    """
+    with run_download_stage(pdb_ids, lookahead, connections=connections, url=url) as (ready, stats):
+        while True:
+            finished.acquire()
+            stats["computed"] += 1
+            try:
+                kind, _, detail = ready.get_nowait()
+                if kind == "error":
+                    warnings.warn(f"Prefetching stopped: {detail!r}")
+            except queue.Empty:
+                pass
+
+            statuses.put(get_pipeline_status(stats, ready))
+
+
+@contextmanager
+def prefetch_pdb_files(
+    pdb_ids: list[str], lookahead: int, connections: int = DOWNLOAD_CONNECTIONS, url: str = RCSB_MMTF_URL
+) -> Iterator[Callable[[], dict[str, str]]]:
+    """
+    Download PDBs in the given order in the background, keeping at most about `lookahead` downloaded
+    ahead of the caller, for work that is run some other way than `map_pdb_ids_pipelined`.
+
+    Yields a function to call each time the caller finishes with a PDB, which makes room for the next
+    download and returns the queue depth and throughput of the download stage.  A PDB the caller gets to
+    before it is prefetched is simply downloaded by the caller as usual.
+
+    The download stage runs in its own process, so the caller is free to fork workers while downloads
+    are under way without a worker inheriting a lock held by a download thread.
+    """
+    finished = multiprocessing.Semaphore(0)
+    statuses: multiprocessing.Queue = multiprocessing.Queue()
+    prefetch_stage = multiprocessing.Process(
+        target=_run_prefetch_stage,
+        args=(pdb_ids, lookahead, connections, url, finished, statuses),
+        daemon=True,
+    )
+    prefetch_stage.start()
+    latest_status: dict[str, str] = {}
+
+    def advance() -> dict[str, str]:
+        finished.release()
+        while True:
+            try:
+                latest_status.update(statuses.get_nowait())
+            except queue.Empty:
+                return latest_status
+
+    try:
+        yield advance
+    finally:
+        prefetch_stage.terminate()
+        prefetch_stage.join()
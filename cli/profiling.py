@@ -0,0 +1,200 @@
+"""
+Opt-in instrumentation recording the wall time, peak memory, and atom count of each
+pipeline stage for each PDB, along with a summary report.
+
+Profiling is enabled by setting the VOLUMIZER_CLI_PROFILE environment variable to the path
+of a log file (or by passing --profile to a script).  Worker processes inherit the variable,
+and every process appends one JSON line per stage to the same log.
+"""
+
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+import json
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from cli import paths
+
+
+PROFILE_ENV_VAR = "VOLUMIZER_CLI_PROFILE"
+SLOWEST_PDB_COUNT = 10
+
+
+def get_profile_log_path() -> Optional[Path]:
+    """
+    Return the profile log path if profiling is enabled, None otherwise.
+    """
+    log_path = os.environ.get(PROFILE_ENV_VAR)
+    if not log_path:
+        return None
+
+    return Path(log_path)
+
+
+def enable_profiling(run_name: str) -> Path:
+    """
+    Enable profiling for this process and any workers it starts, unless already enabled
+    through the environment, and return the log path.
+    """
+    log_path = get_profile_log_path()
+    if log_path is None:
+        log_path = paths.PROFILE_DIR / f"{run_name}_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        os.environ[PROFILE_ENV_VAR] = str(log_path)
+
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    return log_path
+
+
+# the peak resident memory in MB seen so far by each stage open in this process, innermost last
+_OPEN_STAGE_PEAKS: list[list[float]] = []
+
+
+def get_memory_status_mb() -> tuple[float, float]:
+    """
+    Return the current and peak resident memory of this process in MB, where the peak is since the
+    last reset (see `reset_peak_rss`), or since the process started on systems without /proc.
+    """
+    memory_status = {}
+    try:
+        with open("/proc/self/status", mode="r", encoding="utf-8") as status_file:
+            for line in status_file:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    # NOTE: both are in kilobytes
+                    memory_status[line.split(":")[0]] = int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+
+    if len(memory_status) < 2:
+        # NOTE: ru_maxrss is in kilobytes on Linux, and the current resident memory is not available
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak_rss_mb, peak_rss_mb
+
+    return memory_status["VmRSS"], memory_status["VmHWM"]
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset this process's peak resident memory to its current resident memory, returning False if it cannot be.
+    """
+    try:
+        with open("/proc/self/clear_refs", mode="w", encoding="utf-8") as clear_refs_file:
+            clear_refs_file.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+@contextmanager
+def track_peak_rss() -> Iterator[list[float]]:
+    """
+    Track the peak resident memory of the enclosed block in MB, yielding a one-item list that holds it once the
+    block exits, rather than the peak of the whole process, which in a long-lived worker is set by earlier PDBs.
+
+    Blocks may be nested, an inner block's reset of the peak is accounted for in the blocks around it.
+    If the peak cannot be reset, the larger of the resident memory before and after the block is used.
+    """
+    rss_mb, peak_rss_mb = get_memory_status_mb()
+    for stage_peak in _OPEN_STAGE_PEAKS:
+        stage_peak[0] = max(stage_peak[0], peak_rss_mb)
+
+    stage_peak = [rss_mb]
+    can_reset = reset_peak_rss()
+    _OPEN_STAGE_PEAKS.append(stage_peak)
+    try:
+        yield stage_peak
+    finally:
+        _OPEN_STAGE_PEAKS[:] = [open_peak for open_peak in _OPEN_STAGE_PEAKS if open_peak is not stage_peak]
+        rss_mb, peak_rss_mb = get_memory_status_mb()
+        stage_peak[0] = max(stage_peak[0], peak_rss_mb if can_reset else rss_mb)
+
+
+@contextmanager
+def profile_stage(stage: str, pdb_id: str) -> Iterator[dict[str, Any]]:
+    """
+    Time the enclosed block as one stage for one PDB, and record its peak memory.
+
+    Yields a record dictionary, so the block can add an atom count with `record["atoms"] = ...`.
+    Does nothing beyond yielding if profiling is not enabled.
+    """
+    record: dict[str, Any] = {"stage": stage, "pdb_id": pdb_id, "atoms": None}
+    log_path = get_profile_log_path()
+    if log_path is None:
+        yield record
+        return
+
+    start_time = time.perf_counter()
+    try:
+        with track_peak_rss() as stage_peak:
+            yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start_time
+        record["peak_rss_mb"] = stage_peak[0]
+        record["pid"] = os.getpid()
+        with open(log_path, mode="a", encoding="utf-8") as log_file:
+            log_file.write(f"{json.dumps(record)}\n")
+
+
+def get_scaling_exponent(records: pd.DataFrame) -> Optional[float]:
+    """
+    Fit seconds = c * atoms^k on a log-log scale and return k, or None if there is too little data.
+    """
+    records = records[(records["atoms"] > 0) & (records["seconds"] > 0)]
+    if records["atoms"].nunique() < 2:
+        return None
+
+    return float(np.polyfit(np.log(records["atoms"].astype(float)), np.log(records["seconds"]), 1)[0])
+
+
+def summarize_profile(log_path: Path) -> str:
+    """
+    Summarize a profile log: time percentiles and peak memory per stage,
+    how time scales with atom count, and the slowest PDBs.
+    """
+    with open(log_path, mode="r", encoding="utf-8") as log_file:
+        records = pd.DataFrame([json.loads(line) for line in log_file])
+    if records.empty:
+        return "No stages were profiled"
+
+    lines = [f"Profile of {records['pdb_id'].nunique()} PDBs ({log_path})"]
+    lines.append(
+        f"{'stage':<24}{'count':>8}{'total s':>12}{'p50 s':>10}{'p90 s':>10}{'p99 s':>10}{'max s':>10}"
+        f"{'peak MB':>10}{'k':>8}"
+    )
+    for stage, stage_records in records.groupby("stage", sort=False):
+        seconds = stage_records["seconds"]
+        scaling_exponent = get_scaling_exponent(stage_records.dropna(subset=["atoms"]))
+        lines.append(
+            f"{stage:<24}{len(seconds):>8}{seconds.sum():>12.1f}{seconds.quantile(0.5):>10.2f}"
+            f"{seconds.quantile(0.9):>10.2f}{seconds.quantile(0.99):>10.2f}{seconds.max():>10.2f}"
+            f"{stage_records['peak_rss_mb'].max():>10.0f}"
+            f"{'-' if scaling_exponent is None else f'{scaling_exponent:.2f}':>8}"
+        )
+    lines.append("k: exponent of time vs. atom count, seconds ~ atoms^k")
+
+    lines.append(f"Slowest {SLOWEST_PDB_COUNT} PDBs:")
+    pdb_seconds = records.groupby("pdb_id")["seconds"].sum().nlargest(SLOWEST_PDB_COUNT)
+    pdb_atoms = records.groupby("pdb_id")["atoms"].max()
+    for pdb_id, seconds in pdb_seconds.items():
+        atoms = pdb_atoms[pdb_id]
+        lines.append(f"  {pdb_id:<12}{seconds:>10.1f} s{'' if pd.isna(atoms) else f'{int(atoms):>12} atoms'}")
+
+    return "\n".join(lines)
+
+
+def report_profile() -> None:
+    """
+    Print the summary of this run's profile log, if profiling is enabled.
+    """
+    log_path = get_profile_log_path()
+    if log_path is None or not log_path.is_file():
+        return
+
+    print(summarize_profile(log_path))
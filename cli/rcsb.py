@@ -2,57 +2,179 @@
 Functions for using the RCSB.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sized, Union
+import asyncio
+import gzip
+import http.client
+import time
+import urllib.error
+import urllib.request
 
+import numpy as np
 import biotite.structure as bts
 from biotite.structure.io import mmtf
 from biotite.database import rcsb as biotite_rcsb
+from tqdm import tqdm
 
-from cli import utils
-from cli.constants import PDB_ID_LENGTH
+from cli import inventory, utils, profiling, structure_cache
+from cli.constants import (
+    RCSB_MMTF_URL,
+    DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_BACKOFF,
+    DOWNLOAD_TIMEOUT,
+)
 
 
-def parse_cluster_file(lines: list[str]) -> set[str]:
+def download_pdb_file(pdb_id: str) -> bool:
     """
-    Take the lines from an RCSB cluster file and return a list of all the PDB IDs in the file.
+    Download the biological assembly from the RCSB.
+    Unzip and save the PDB.
     """
-    return {
-            f"{line.split()[0].split('_')[0]}\n"
-            for line in lines
-            if len(line.split()[0].split('_')[0]) == PDB_ID_LENGTH
-        }
+    download_path = utils.get_downloaded_pdb_path(pdb_id)
+    if not inventory.exists(download_path):
+        try:
+            with profiling.profile_stage("download", pdb_id):
+                mmtf_file = mmtf.MMTFFile.read(biotite_rcsb.fetch(pdb_id, "mmtf"))
+                with utils.atomic_output(download_path) as (partial_path,):
+                    with utils.open_data_file(partial_path, mode="wb") as out_file:
+                        mmtf_file.write(out_file)
+        except (ConnectionError):
+            return False
+
+    return True
 
 
-def build_pdb_set(cluster_file: Path) -> set[str]:
+def fetch_mmtf(pdb_id: str, url: str = RCSB_MMTF_URL, timeout: float = DOWNLOAD_TIMEOUT) -> bytes:
     """
-    Get a set of all the PDB IDs we want to download and process.
+    Fetch the raw MMTF for a PDB ID, decompressing it if the server sent it gzipped.
     """
-    with open(cluster_file, mode="r", encoding="utf-8") as fi:
-        return parse_cluster_file(fi.readlines())
+    with urllib.request.urlopen(url.format(pdb_id=pdb_id), timeout=timeout) as response:
+        content = response.read()
 
+    if content[:2] == b"\x1f\x8b":
+        content = gzip.decompress(content)
 
-def download_pdb_file(pdb_id: str) -> bool:
+    return content
+
+
+def save_mmtf(content: bytes, download_path: Path) -> None:
     """
-    Download the biological assembly from the RCSB.
-    Unzip and save the PDB.
+    Check that `content` parses as MMTF, then write it to `download_path`.
+
+    The file is written under a temporary name and renamed into place, so an interrupted
+    download never leaves a truncated file that looks complete.  Raises ValueError if `content`
+    does not parse, whatever the MessagePack or MMTF decoder raised.
+    """
+    try:
+        mmtf.MMTFFile.read(BytesIO(content))
+    except Exception as error:
+        raise ValueError(f"Downloaded content is not valid MMTF: {error!r}") from error
+
+    with utils.atomic_output(download_path) as (partial_path,):
+        with utils.open_data_file(partial_path, mode="wb") as out_file:
+            out_file.write(content)
+
+
+async def download_pdb_file_async(
+    pdb_id: str, url: str, retries: int, backoff: float
+) -> tuple[str, int]:
+    """
+    Download a single MMTF without blocking the event loop, retrying with exponential backoff.
+
+    Returns the download status ("cached", "downloaded", or "failed") and the number of bytes fetched.
     """
     download_path = utils.get_downloaded_pdb_path(pdb_id)
-    if not download_path.is_file():
+    if inventory.exists(download_path):
+        return "cached", 0
+
+    for attempt in range(retries + 1):
         try:
-            mmtf_file = mmtf.MMTFFile.read(biotite_rcsb.fetch(pdb_id, "mmtf"))
-            mmtf_file.write(download_path)
-        except (ConnectionError):
-            return False
+            content = await asyncio.to_thread(fetch_mmtf, pdb_id, url)
+            await asyncio.to_thread(save_mmtf, content, download_path)
+            return "downloaded", len(content)
+        except urllib.error.HTTPError as error:
+            # the entry does not exist (or has no MMTF), retrying will not help
+            if error.code == 404:
+                return "failed", 0
+        except (OSError, EOFError, ValueError, http.client.HTTPException):
+            # e.g. a dropped connection, a truncated response or gzip stream, or content that does not parse
+            pass
 
-    return True
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2**attempt)
+
+    return "failed", 0
+
+
+async def _download_pdb_files(
+    pdb_ids: Iterator[str], total: Optional[int], connections: int, url: str, retries: int, backoff: float
+) -> dict[str, Union[int, float, list[str]]]:
+    """
+    Run `connections` concurrent downloaders, each pulling the next ID from a shared iterator.
+    """
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=connections))
+    report = {"downloaded": 0, "cached": 0, "failed": [], "bytes": 0}
+    progress = tqdm(total=total, desc="Downloading")
+
+    async def downloader():
+        for pdb_id in pdb_ids:
+            status, num_bytes = await download_pdb_file_async(pdb_id, url, retries, backoff)
+            if status == "failed":
+                report["failed"].append(pdb_id)
+            else:
+                report[status] += 1
+            report["bytes"] += num_bytes
+            progress.update()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[downloader() for _ in range(connections)])
+    report["seconds"] = time.perf_counter() - start_time
+    progress.close()
+
+    return report
+
+
+def download_pdb_files(
+    pdb_ids: Iterable[str],
+    connections: int = DOWNLOAD_CONNECTIONS,
+    url: str = RCSB_MMTF_URL,
+    retries: int = DOWNLOAD_RETRIES,
+    backoff: float = DOWNLOAD_BACKOFF,
+) -> dict[str, Union[int, float, list[str]]]:
+    """
+    Download the MMTF files for many PDB IDs using `connections` concurrent connections.
+
+    Files already on disk are skipped, so an interrupted run can simply be restarted.
+    IDs are pulled from `pdb_ids` as connections free up, so it may be a lazy iterator.
+    `url` is a format string with a `pdb_id` field, which allows pointing at a local mirror.
+    Returns a report of counts, failed IDs, bytes fetched, and elapsed seconds.
+    """
+    total = len(pdb_ids) if isinstance(pdb_ids, Sized) else None
+
+    return asyncio.run(_download_pdb_files(iter(pdb_ids), total, connections, url, retries, backoff))
+
+
+def read_mmtf_file(mmtf_path: Path) -> mmtf.MMTFFile:
+    """
+    Read a (possibly gzipped) MMTF file, reusing this worker's parsed copy if it was read recently.
+    """
+
+    def read() -> mmtf.MMTFFile:
+        with utils.open_data_file(mmtf_path) as in_file:
+            return mmtf.MMTFFile.read(in_file)
+
+    return structure_cache.get_cached(str(mmtf_path), "mmtf", read, size=lambda mmtf_file: mmtf_file["numAtoms"])
 
 
 def get_biological_assembly(pdb_id: str) -> bts.AtomArray:
     """
     Load the biological assembly of a PDB.
     """
-    download_path = utils.get_downloaded_pdb_path(pdb_id)
-    mmtf_file = mmtf.MMTFFile.read(download_path)
+    mmtf_file = read_mmtf_file(utils.get_downloaded_pdb_path(pdb_id))
 
     try:
         biological_assembly = mmtf.get_assembly(mmtf_file, assembly_id="1", model=1)
@@ -62,11 +184,86 @@ def get_biological_assembly(pdb_id: str) -> bts.AtomArray:
     return biological_assembly
 
 
+def get_assembly_chain_multiplicities(mmtf_file: mmtf.MMTFFile, assembly_id: str = "1") -> Optional[dict[str, int]]:
+    """
+    Return how many copies of each asymmetric unit chain, by chain ID, the symmetry operators of a biological
+    assembly produce, without applying them.  Returns None if the file does not describe the assembly.
+    """
+    try:
+        assembly = next(
+            assembly for assembly in mmtf_file["bioAssemblyList"] if str(assembly["name"]) == assembly_id
+        )
+        chain_names = np.asarray(mmtf_file["chainNameList"])
+    except (KeyError, StopIteration):
+        return None
+
+    # NOTE: like the assembly builder, each transform selects chains by name
+    chain_multiplicities: dict[str, int] = {}
+    for transform in assembly["transformList"]:
+        for chain_name in np.unique(chain_names[transform["chainIndexList"]]).tolist():
+            chain_multiplicities[chain_name] = chain_multiplicities.get(chain_name, 0) + 1
+
+    return chain_multiplicities
+
+
+def get_asymmetric_unit(pdb_id: str, assembly_id: str = "1") -> tuple[bts.AtomArray, dict[str, int]]:
+    """
+    Load the asymmetric unit of a PDB along with how many copies of each of its chains the biological assembly has.
+
+    Falls back to one copy of each chain, as `get_biological_assembly` falls back to the asymmetric unit,
+    if the file does not describe the assembly.
+    """
+    mmtf_file = read_mmtf_file(utils.get_downloaded_pdb_path(pdb_id))
+    asymmetric_unit = mmtf.get_structure(mmtf_file, model=1)
+
+    chain_multiplicities = get_assembly_chain_multiplicities(mmtf_file, assembly_id)
+    if chain_multiplicities is None:
+        chain_multiplicities = {chain_id: 1 for chain_id in np.unique(asymmetric_unit.chain_id).tolist()}
+
+    return asymmetric_unit, chain_multiplicities
+
+
+def estimate_assembly_size_metrics(mmtf_path: Path, assembly_id: str = "1") -> Optional[dict[str, int]]:
+    """
+    Estimate the size metrics of the first model of a biological assembly from the MMTF
+    chain, group, and assembly transform lists alone, without decoding any coordinates.
+
+    Atom and residue counts follow the full assembly, while the chain count is an upper bound
+    since adjacent copies of a chain keep the same chain ID.
+    Returns None if the file does not describe the assembly.
+    """
+    mmtf_file = read_mmtf_file(mmtf_path)
+    try:
+        assembly = next(
+            assembly for assembly in mmtf_file["bioAssemblyList"] if str(assembly["name"]) == assembly_id
+        )
+        num_chains = mmtf_file["chainsPerModel"][0]
+        chain_names = np.asarray(mmtf_file["chainNameList"])
+        groups_per_chain = np.asarray(mmtf_file["groupsPerChain"][:num_chains])
+        atoms_per_group_type = np.array([len(group["atomNameList"]) for group in mmtf_file["groupList"]])
+        group_types = np.asarray(mmtf_file["groupTypeList"][: groups_per_chain.sum()])
+    except (KeyError, IndexError, StopIteration):
+        return None
+
+    group_chains = np.repeat(np.arange(num_chains), groups_per_chain)
+    atoms_per_chain = np.bincount(group_chains, weights=atoms_per_group_type[group_types], minlength=num_chains)
+
+    # NOTE: like the assembly builder, select chains by name, which may pull in ligand chains sharing the name
+    size_metrics = {"atoms": 0, "residues": 0, "chains": 0}
+    for transform in assembly["transformList"]:
+        selected_chains = np.isin(chain_names[:num_chains], chain_names[transform["chainIndexList"]])
+        size_metrics["atoms"] += int(atoms_per_chain[selected_chains].sum())
+        size_metrics["residues"] += int(groups_per_chain[selected_chains].sum())
+        size_metrics["chains"] += int(np.count_nonzero(selected_chains))
+
+    return size_metrics
+
+
 def get_resolution(mmtf_path: Path) -> float | None:
     """
     Determine the resolution of the structure.
     """
-    mmtf_file = mmtf.MMTFFile.read(mmtf_path)
+    mmtf_file = read_mmtf_file(mmtf_path)
     try:
         return mmtf_file["resolution"]
     except (KeyError, ValueError):
@@ -0,0 +1,104 @@
+"""
+Functions to order and batch per-PDB work by its predicted cost, so the largest jobs start
+first and workers finish together rather than waiting on a few huge assemblies at the end.
+"""
+
+
+from typing import Iterator, Optional, TypeVar
+import heapq
+import itertools
+import statistics
+
+from cli import ledger, utils
+from cli.constants import BATCHES_PER_WORKER, MAX_BATCH_SIZE, RATE_SAMPLE_SIZE
+
+
+T = TypeVar("T")
+
+
+def get_pdb_costs(pdb_ids: list[str]) -> dict[str, float]:
+    """
+    Predict the cost of each PDB from its cached atom count.
+
+    PDBs without size metrics on file are given the median cost of those with them.
+    """
+    pdb_size_metrics = utils.load_all_pdb_size_metrics(pdb_ids)
+    known_costs = [float(size_metrics["atoms"]) for size_metrics in pdb_size_metrics.values()]
+    default_cost = statistics.median(known_costs) if len(known_costs) > 0 else 1.0
+
+    return {
+        pdb_id: float(pdb_size_metrics[pdb_id]["atoms"]) if pdb_id in pdb_size_metrics else default_cost
+        for pdb_id in pdb_ids
+    }
+
+
+def schedule_by_cost(
+    costs: dict[T, float],
+    jobs: int,
+    batches_per_worker: int = BATCHES_PER_WORKER,
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> list[list[T]]:
+    """
+    Split work into batches ordered longest first.
+
+    Anything costing more than an even share of `batches_per_worker` batches per worker runs alone,
+    and smaller jobs are grouped into batches of up to that cost (and `max_batch_size` items),
+    which cuts per-task overhead without leaving a large batch to run last.
+    """
+    if len(costs) == 0:
+        return []
+
+    target_batch_cost = sum(costs.values()) / (jobs * batches_per_worker)
+    batches: list[list[T]] = []
+    batch: list[T] = []
+    batch_cost = 0.0
+    for item in sorted(costs, key=costs.get, reverse=True):
+        if len(batch) > 0 and (batch_cost + costs[item] > target_batch_cost or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+            batch_cost = 0.0
+        batch.append(item)
+        batch_cost += costs[item]
+    batches.append(batch)
+
+    return batches
+
+
+def get_start_order(batches: list[list[T]], jobs: int) -> Iterator[T]:
+    """
+    Yield the items of the batches in roughly the order `jobs` workers will start them,
+    taking the batches `jobs` at a time and interleaving the items of those running side by side.
+    """
+    for window_start in range(0, len(batches), jobs):
+        for items in itertools.zip_longest(*batches[window_start : window_start + jobs]):
+            yield from (item for item in items if item is not None)
+
+
+def project_makespan(batch_costs: list[float], jobs: int) -> float:
+    """
+    Project the total cost the busiest worker will get through when each batch, in order,
+    goes to the next free worker.
+    """
+    worker_costs = [0.0] * jobs
+    for batch_cost in batch_costs:
+        heapq.heapreplace(worker_costs, worker_costs[0] + batch_cost)
+
+    return max(worker_costs)
+
+
+def estimate_seconds_per_cost(stage: str, sample_size: int = RATE_SAMPLE_SIZE) -> Optional[float]:
+    """
+    Estimate how many seconds each unit of cost (atom) takes in a stage, from the most recent
+    completed jobs in the ledger.  Returns None if there are no completed jobs to go on.
+    """
+    job_seconds = ledger.get_job_seconds(stage, sample_size)
+    pdb_costs = utils.load_all_pdb_size_metrics(job_seconds.keys())
+    rates = [
+        job_seconds[pdb_id] / size_metrics["atoms"]
+        for pdb_id, size_metrics in pdb_costs.items()
+        if size_metrics["atoms"] > 0
+    ]
+    if len(rates) == 0:
+        return None
+
+    return statistics.median(rates)
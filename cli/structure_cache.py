@@ -0,0 +1,114 @@
+"""
+A per-worker cache of parsed structures, keyed by PDB ID and pipeline stage, so that stages
+running in the same process do not re-read and re-parse the same file.
+
+Optionally, cleaned structures are also persisted as a single NumPy structured array per PDB,
+which is memory-mapped on load instead of being decoded again.  Persistence is enabled by setting
+the VOLUMIZER_CLI_STRUCTURE_ARRAYS environment variable (or passing --persist-structures to a script),
+so worker processes inherit it.
+"""
+
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar
+import os
+
+import numpy as np
+import biotite.structure as bts
+
+from cli import paths, utils
+from cli.constants import STRUCTURE_CACHE_MAX_ATOMS
+
+
+T = TypeVar("T")
+
+STRUCTURE_ARRAYS_ENV_VAR = "VOLUMIZER_CLI_STRUCTURE_ARRAYS"
+STRUCTURE_ARRAY_ANNOTATIONS = ("chain_id", "res_id", "ins_code", "res_name", "hetero", "atom_name", "element")
+
+# (PDB ID, stage) -> (value, size in atoms), least recently used first
+_CACHE: OrderedDict[tuple[str, str], tuple[Any, int]] = OrderedDict()
+
+
+def get_cached(pdb_id: str, stage: str, load: Callable[[], T], size: Callable[[T], int] = len) -> T:
+    """
+    Return the cached value for this PDB and stage, calling `load` and caching the result on a miss.
+
+    The cache holds at most STRUCTURE_CACHE_MAX_ATOMS atoms in total, as measured by `size`,
+    evicting the least recently used entries first.  None is never cached.
+    """
+    key = (pdb_id, stage)
+    if key in _CACHE:
+        _CACHE.move_to_end(key)
+        return _CACHE[key][0]
+
+    value = load()
+    if value is not None:
+        _CACHE[key] = (value, size(value))
+        while len(_CACHE) > 1 and sum(entry[1] for entry in _CACHE.values()) > STRUCTURE_CACHE_MAX_ATOMS:
+            _CACHE.popitem(last=False)
+
+    return value
+
+
+def clear_cache() -> None:
+    """
+    Empty this worker's cache.
+    """
+    _CACHE.clear()
+
+
+def enable_structure_arrays() -> None:
+    """
+    Persist cleaned structures as structure arrays, in this process and any workers it starts.
+    """
+    os.environ[STRUCTURE_ARRAYS_ENV_VAR] = "1"
+    paths.STRUCTURE_ARRAY_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def are_structure_arrays_enabled() -> bool:
+    """
+    Are cleaned structures being persisted as structure arrays.
+    """
+    return bool(os.environ.get(STRUCTURE_ARRAYS_ENV_VAR))
+
+
+def get_structure_array_path(pdb_id: str, stage: str) -> Path:
+    """
+    Return the path to the structure array for this PDB ID and stage.
+    """
+    # NOTE: arrays are never compressed, so that they can be memory-mapped
+    return utils.get_data_path(paths.STRUCTURE_ARRAY_DIR, f"{pdb_id}.{stage}", ".npy", compressible=False)
+
+
+def save_structure_array(structure: bts.AtomArray, array_path: Path) -> None:
+    """
+    Save a structure as one structured array, with strings stored as bytes to keep it compact.
+    """
+    annotations = {name: structure.get_annotation(name) for name in STRUCTURE_ARRAY_ANNOTATIONS}
+    dtype = [
+        (name, annotation.dtype.str.replace("U", "S") if annotation.dtype.kind == "U" else annotation.dtype)
+        for name, annotation in annotations.items()
+    ]
+    structure_array = np.empty(len(structure), dtype=[*dtype, ("coord", np.float32, (3,))])
+    for name, annotation in annotations.items():
+        structure_array[name] = annotation
+    structure_array["coord"] = structure.coord
+
+    with open(array_path, mode="wb") as out_file:
+        np.save(out_file, structure_array)
+
+
+def load_structure_array(array_path: Path, mmap_mode: Optional[str] = "r") -> bts.AtomArray:
+    """
+    Load a structure saved with `save_structure_array`, memory-mapped by default.
+    """
+    structure_array = np.load(array_path, mmap_mode=mmap_mode)
+
+    structure = bts.AtomArray(len(structure_array))
+    structure.coord = structure_array["coord"]
+    for name in STRUCTURE_ARRAY_ANNOTATIONS:
+        annotation = structure_array[name]
+        structure.set_annotation(name, annotation.astype(str) if annotation.dtype.kind == "S" else annotation)
+
+    return structure
@@ -0,0 +1,119 @@
+"""
+Run batches of work in supervised worker processes, killing any worker whose current item
+runs too long or uses too much memory, so a single pathological PDB cannot hang or take down a run.
+
+Each batch runs in a fresh process which reports as it starts and finishes each item.  When a worker
+is killed or dies, its current item is reported as killed and the rest of its batch is run in a new worker.
+"""
+
+
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+import multiprocessing
+import time
+
+from cli.constants import SUPERVISOR_POLL_INTERVAL
+
+
+T = TypeVar("T")
+
+
+def get_rss_mb(process_id: int) -> Optional[float]:
+    """
+    Return the current resident memory of a process in MB, or None if it cannot be read.
+    """
+    try:
+        with open(f"/proc/{process_id}/status", mode="r", encoding="utf-8") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    # NOTE: VmRSS is in kilobytes
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        return None
+
+    return None
+
+
+def _run_batch(function: Callable[[T], Any], batch: list[T], connection: Connection) -> None:
+    """
+    Worker process entry-point: run `function` on each item, reporting the start and outcome of each.
+    """
+    for item in batch:
+        connection.send(("started", item, None))
+        try:
+            connection.send(("done", item, function(item)))
+        except Exception as error:
+            connection.send(("failed", item, repr(error)))
+
+    connection.close()
+
+
+def run_supervised(
+    function: Callable[[T], Any],
+    batches: Iterable[list[T]],
+    jobs: int,
+    timeout: Optional[float] = None,
+    max_memory_mb: Optional[float] = None,
+    poll_interval: float = SUPERVISOR_POLL_INTERVAL,
+) -> Iterator[tuple[T, str, Any, float]]:
+    """
+    Run `function` over every item in `batches`, with up to `jobs` worker processes at once.
+
+    Yields (item, status, detail, seconds) as each item finishes, where status is "done" with the result
+    as the detail, "failed" with the exception raised, or "killed" with the reason the worker was stopped:
+    the item ran longer than `timeout` seconds, the worker grew beyond `max_memory_mb`, or the worker died.
+    """
+    remaining_batches = deque(batches)
+    # worker process -> [connection, remaining batch items, current item, current item start time]
+    workers: dict[multiprocessing.Process, list] = {}
+
+    def end_worker(process: multiprocessing.Process, reason: Optional[str]) -> Iterator[tuple[T, str, Any, float]]:
+        connection, batch, item, start_time = workers.pop(process)
+        if process.is_alive():
+            process.kill()
+        process.join()
+        connection.close()
+        if item is not None:
+            yield item, "killed", reason or f"worker exited with code {process.exitcode}", time.time() - start_time
+            batch.popleft()
+        if len(batch) > 0:
+            remaining_batches.appendleft(list(batch))
+
+    while len(remaining_batches) > 0 or len(workers) > 0:
+        while len(remaining_batches) > 0 and len(workers) < jobs:
+            batch = remaining_batches.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_run_batch, args=(function, batch, sender))
+            process.start()
+            sender.close()
+            workers[process] = [receiver, deque(batch), None, None]
+
+        connections = {worker[0]: process for process, worker in workers.items()}
+        for connection in wait(list(connections), timeout=poll_interval):
+            process = connections[connection]
+            try:
+                status, item, detail = connection.recv()
+            except EOFError:
+                # the worker has finished its batch, or died part way through an item
+                yield from end_worker(process, None)
+                continue
+
+            worker = workers[process]
+            if status == "started":
+                worker[2] = item
+                worker[3] = time.time()
+            else:
+                yield item, status, detail, time.time() - worker[3]
+                worker[1].popleft()
+                worker[2] = None
+
+        for process, (_, _, item, start_time) in list(workers.items()):
+            if item is None:
+                continue
+            if timeout is not None and time.time() - start_time > timeout:
+                yield from end_worker(process, f"timed out after {timeout:.0f} s")
+                continue
+            rss_mb = get_rss_mb(process.pid)
+            if max_memory_mb is not None and rss_mb is not None and rss_mb > max_memory_mb:
+                yield from end_worker(process, f"exceeded {max_memory_mb:.0f} MB with {rss_mb:.0f} MB resident")
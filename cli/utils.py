@@ -3,41 +3,187 @@ Functions to interpret CLI commands.
 """
 
 
+from contextlib import contextmanager
+from functools import cache
 from pathlib import Path
-from typing import Optional
+from typing import IO, Iterable, Iterator, Optional, TypeVar
+import gzip
+import itertools
+import json
+import os
+import shutil
 
 import pandas as pd
-import json
+import biotite.structure as bts
+from biotite.structure.io import load_structure, save_structure, mmtf
+from tqdm import tqdm
+
+from cli import coordination, ids, inventory, paths, metric_store
+
+
+T = TypeVar("T")
+
+
+# the file format of each kind of stored structure, chosen by suffix, which every path helper,
+# loader, and saver goes through so that they always agree
+STRUCTURE_SUFFIXES = {
+    "downloaded": ".mmtf",
+    "prepared": ".mmtf",
+    "annotated": ".mmtf",
+}
+STRUCTURE_DIRS = {
+    "downloaded": paths.DOWNLOADED_PDB_DIR,
+    "prepared": paths.PREPARED_PDB_DIR,
+    "annotated": paths.ANNOTATED_PDB_DIR,
+}
+# per-atom fields kept when loading each kind, the volumizer writes its annotation into the B-factor and occupancy
+STRUCTURE_EXTRA_FIELDS = {
+    "downloaded": [],
+    "prepared": [],
+    "annotated": ["b_factor", "occupancy"],
+}
+
+
+def get_shard(file_stem: str) -> str:
+    """
+    Return the name of the subdirectory a stored file lives in: the middle two characters
+    of its PDB ID in lower case, as in the wwPDB archive.
+    """
+    return file_stem[1:3].lower() or "_"
+
+
+@cache
+def is_compression_enabled() -> bool:
+    """
+    Are stored files gzip compressed, as recorded in the data layout file by the last migration.
+    """
+    if not paths.DATA_LAYOUT_PATH.is_file():
+        return False
+
+    with open(paths.DATA_LAYOUT_PATH, mode="r", encoding="utf-8") as in_file:
+        return bool(json.load(in_file).get("compress", False))
+
+
+def get_data_path(data_dir: Path, file_stem: str, suffix: str, compressible: bool = True) -> Path:
+    """
+    Return the path to a stored file, within its shard of `data_dir` and gzip compressed if enabled.
+    """
+    if compressible and is_compression_enabled():
+        suffix = f"{suffix}.gz"
+
+    return data_dir / get_shard(file_stem) / f"{file_stem}{suffix}"
+
+
+def get_file_stem(data_path: Path) -> str:
+    """
+    Return the stem of a stored file, ignoring any compression suffix.
+    """
+    return Path(data_path.name.removesuffix(".gz")).stem
+
+
+def iter_data_files(data_dir: Path, suffix: str) -> Iterator[Path]:
+    """
+    Lazily yield every stored file with this suffix in the shards of `data_dir`, compressed or not.
+    """
+    yield from data_dir.glob(f"*/*{suffix}")
+    yield from data_dir.glob(f"*/*{suffix}.gz")
+
+
+def open_data_file(data_path: Path, mode: str = "rb") -> IO:
+    """
+    Open a stored file, transparently compressing or decompressing it if it is gzipped.
+    """
+    if data_path.suffix == ".gz":
+        return gzip.open(data_path, mode)
+
+    return open(data_path, mode)
+
+
+def read_structure(structure_path: Path, extra_fields: Optional[list[str]] = None) -> bts.AtomArray:
+    """
+    Load a structure in any format biotite reads, or from gzipped MMTF, along with any `extra_fields`
+    (e.g. "b_factor") as annotations.
+    """
+    if structure_path.suffix != ".gz":
+        return load_structure(structure_path, extra_fields=extra_fields or [])
+
+    with open_data_file(structure_path) as in_file:
+        return mmtf.get_structure(mmtf.MMTFFile.read(in_file), model=1, extra_fields=extra_fields or [])
+
+
+def write_structure(structure_path: Path, structure: bts.AtomArray) -> None:
+    """
+    Save a structure in any format biotite writes, or as gzipped MMTF.
+    """
+    if structure_path.suffix != ".gz":
+        save_structure(structure_path, structure)
+        return
 
-from cli import paths
+    mmtf_file = mmtf.MMTFFile()
+    mmtf.set_structure(mmtf_file, structure)
+    with open_data_file(structure_path, mode="wb") as out_file:
+        mmtf_file.write(out_file)
+
+
+def get_structure_path(kind: str, file_stem: str) -> Path:
+    """
+    Return the path to a stored structure of the given kind: "downloaded", "prepared", or "annotated".
+    """
+    return get_data_path(STRUCTURE_DIRS[kind], file_stem, STRUCTURE_SUFFIXES[kind])
+
+
+def load_stored_structure(kind: str, file_stem: str) -> bts.AtomArray:
+    """
+    Load a stored structure of the given kind in its registered format.
+    """
+    return read_structure(get_structure_path(kind, file_stem), STRUCTURE_EXTRA_FIELDS[kind])
+
+
+def save_stored_structure(kind: str, file_stem: str, structure: bts.AtomArray) -> None:
+    """
+    Save a structure of the given kind in its registered format.
+    """
+    with atomic_output(get_structure_path(kind, file_stem)) as (partial_path,):
+        write_structure(partial_path, structure)
 
 
 def get_downloaded_pdb_path(pdb_id: str) -> Path:
     """
     Return the path to the downloaded PDB file for this PDB ID.
     """
-    return paths.DOWNLOADED_PDB_DIR / f"{pdb_id}.mmtf"
+    return get_structure_path("downloaded", pdb_id)
 
 
 def get_prepared_pdb_path(pdb_id: str) -> Path:
     """
     Return the path to the cleaned PDB file for this PDB ID.
     """
-    return paths.PREPARED_PDB_DIR / f"{pdb_id}.mmtf"
+    return get_structure_path("prepared", pdb_id)
 
 
-def get_annotated_pdb_path(pdb_id: str) -> Path:
+def get_annotation_stem(pdb_id: str, resolution: Optional[float] = None) -> str:
+    """
+    Return the file stem of the annotation outputs for this PDB ID, including the voxel
+    resolution if given, so that outputs at several resolutions can coexist.
+    """
+    if resolution is None:
+        return pdb_id
+
+    return f"{pdb_id}.{resolution}"
+
+
+def get_annotated_pdb_path(pdb_id: str, resolution: Optional[float] = None) -> Path:
     """
     Return the path to the annotated PDB file for this PDB ID.
     """
-    return paths.ANNOTATED_PDB_DIR / f"{pdb_id}.pdb"
+    return get_structure_path("annotated", get_annotation_stem(pdb_id, resolution))
 
 
-def get_annotated_df_path(pdb_id: str) -> Path:
+def get_annotated_df_path(pdb_id: str, resolution: Optional[float] = None) -> Path:
     """
     Return the path to the annotated dataframe for this PDB ID.
     """
-    return paths.ANNOTATED_DF_DIR / f"{pdb_id}.json"
+    return get_data_path(paths.ANNOTATED_DF_DIR, get_annotation_stem(pdb_id, resolution), ".json")
 
 
 def is_pdb_downloaded(pdb_id: str) -> bool:
@@ -48,21 +194,21 @@ def is_pdb_downloaded(pdb_id: str) -> bool:
     if downloaded_path is None:
         return False
 
-    return get_downloaded_pdb_path(pdb_id).is_file()
+    return inventory.exists(get_downloaded_pdb_path(pdb_id))
 
 
 def is_pdb_prepared(pdb_id: str) -> bool:
     """
     Has the PDB been fully processed.
     """
-    return get_prepared_pdb_path(pdb_id).is_file()
+    return inventory.exists(get_prepared_pdb_path(pdb_id))
 
 
 def is_pdb_annotated(pdb_id: str) -> bool:
     """
     Has the PDB been fully processed.
     """
-    return get_annotated_pdb_path(pdb_id).is_file()
+    return inventory.exists(get_annotated_pdb_path(pdb_id))
 
 
 def setup_dirs():
@@ -73,7 +219,104 @@ def setup_dirs():
     paths.PREPARED_PDB_DIR.mkdir(parents=True, exist_ok=True)
     paths.ANNOTATED_PDB_DIR.mkdir(parents=True, exist_ok=True)
     paths.ANNOTATED_DF_DIR.mkdir(parents=True, exist_ok=True)
-    paths.PDB_FILTERING_METRIC_DIR.mkdir(parents=True, exist_ok=True)
+    paths.PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+
+
+@contextmanager
+def atomic_output(*output_paths: Path) -> Iterator[list[Path]]:
+    """
+    Yield temporary paths to write the given outputs to, and move them into place only once
+    the block completes, so an interrupted write never leaves a file that looks complete.
+    """
+    partial_paths = [paths.PARTIAL_DIR / f"{coordination.get_owner()}_{output_path.name}" for output_path in output_paths]
+    try:
+        yield partial_paths
+    except BaseException:
+        for partial_path in partial_paths:
+            partial_path.unlink(missing_ok=True)
+        raise
+
+    for partial_path, output_path in zip(partial_paths, output_paths):
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(partial_path, output_path)
+        inventory.record(output_path)
+
+
+def remove_partial_outputs(file_stem: str, owner: str) -> int:
+    """
+    Remove the partial outputs `owner` left for a file stem (at any resolution), e.g. when it was killed
+    part way through writing them.  Returns the number of files removed.
+    """
+    partial_paths = list(paths.PARTIAL_DIR.glob(f"{owner}_{file_stem}.*"))
+    for partial_path in partial_paths:
+        partial_path.unlink(missing_ok=True)
+
+    return len(partial_paths)
+
+
+def migrate_data_dir(data_dir: Path, suffix: str, compressible: bool = True) -> int:
+    """
+    Move every stored file with this suffix in `data_dir`, flat or sharded, compressed or not,
+    to where the current layout expects it.  Returns the number of files moved.
+    """
+    moved = 0
+    data_file_paths = [
+        *data_dir.glob(f"*{suffix}"),
+        *data_dir.glob(f"*{suffix}.gz"),
+        *iter_data_files(data_dir, suffix),
+    ]
+    for data_path in tqdm(data_file_paths, desc=f"Migrating {data_dir.name}"):
+        target_path = get_data_path(data_dir, get_file_stem(data_path), suffix, compressible)
+        if target_path == data_path:
+            continue
+
+        if target_path.name == data_path.name:
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(data_path, target_path)
+        else:
+            with atomic_output(target_path) as (partial_path,):
+                with open_data_file(data_path) as in_file, open_data_file(partial_path, mode="wb") as out_file:
+                    shutil.copyfileobj(in_file, out_file)
+            data_path.unlink()
+        moved += 1
+
+    return moved
+
+
+def convert_legacy_annotated_pdbs() -> int:
+    """
+    Convert annotated structures saved as PDB text, from before the format registry, to the registered format.
+    Returns the number of files converted.
+    """
+    legacy_paths = [*paths.ANNOTATED_PDB_DIR.glob("*.pdb"), *paths.ANNOTATED_PDB_DIR.glob("*/*.pdb")]
+    for legacy_path in tqdm(legacy_paths, desc="Converting annotated PDBs"):
+        save_stored_structure(
+            "annotated", legacy_path.stem, read_structure(legacy_path, STRUCTURE_EXTRA_FIELDS["annotated"])
+        )
+        legacy_path.unlink()
+
+    return len(legacy_paths)
+
+
+def migrate_data_layout(compress: bool) -> dict[str, int]:
+    """
+    Record the data layout (sharded, and gzip compressed or not) and move every stored file to match it.
+    Returns the number of files moved in each data directory.
+    """
+    paths.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(paths.DATA_LAYOUT_PATH, mode="w", encoding="utf-8") as out_file:
+        json.dump({"sharded": True, "compress": compress}, out_file)
+    is_compression_enabled.cache_clear()
+
+    moved = {
+        data_dir.name: migrate_data_dir(data_dir, STRUCTURE_SUFFIXES[kind])
+        for kind, data_dir in STRUCTURE_DIRS.items()
+    }
+    moved[paths.ANNOTATED_DF_DIR.name] = migrate_data_dir(paths.ANNOTATED_DF_DIR, ".json")
+    moved[paths.STRUCTURE_ARRAY_DIR.name] = migrate_data_dir(paths.STRUCTURE_ARRAY_DIR, ".npy", compressible=False)
+    moved["legacy annotated PDBs"] = convert_legacy_annotated_pdbs()
+
+    return moved
 
 
 def save_annotation_dataframe(annotation_df: pd.DataFrame, save_file: Path):
@@ -88,9 +331,7 @@ def have_annotation(file_stem: str) -> bool:
     If we have already completed the annotation of this file, return True.
     False otherwise.
     """
-    pdb_path = paths.ANNOTATED_PDB_DIR / f"{file_stem}.pdb"
-    df_path = paths.ANNOTATED_DF_DIR / f"{file_stem}.json"
-    if pdb_path.is_file() and df_path.is_file():
+    if inventory.exists(get_annotated_pdb_path(file_stem)) and inventory.exists(get_annotated_df_path(file_stem)):
         return True
 
     return False
@@ -100,90 +341,125 @@ def load_annotation_df(file_stem: str, resolution: float = 3.0) -> pd.DataFrame:
     """
     Return the annotation dataframe associated with this file-stem.
     """
-    return pd.read_json(paths.ANNOTATED_DF_DIR / f"{file_stem}.{resolution}.json")
+    return pd.read_json(get_annotated_df_path(file_stem, resolution))
+
+
+def save_resolution(pdb_id: str, resolution: float) -> None:
+    """
+    Save the resolution of a PDB.
+    """
+    metric_store.save_metrics(pdb_id, {"resolution": resolution})
+
+
+def load_resolution(pdb_id: str) -> Optional[float]:
+    """
+    Load the resolution of a PDB, or None if it has not been recorded.
+    """
+    metrics = metric_store.load_metrics(pdb_id, metric_store.RESOLUTION_COLUMNS)
+    if metrics is None:
+        return None
+
+    return metrics["resolution"]
 
 
 def have_pdb_size_metrics_on_file(pdb_id: str) -> bool:
     """
     Check to see if the PDB size metrics have been recorded previously.
     """
-    return (paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_size.json").is_file()
+    return metric_store.load_metrics(pdb_id, metric_store.SIZE_COLUMNS) is not None
 
 
 def save_pdb_size_metrics(pdb_id: str, metrics: dict[str, int]) -> None:
     """
     Save the number of atoms, residues, and chains in a PDB assembly.
     """
-    with open(paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_size.json", mode="w", encoding="utf-8") as out_file:
-        json.dump(metrics, out_file)
+    metric_store.save_metrics(pdb_id, metrics)
 
 
 def load_pdb_size_metrics(pdb_id: str) -> Optional[dict[str, int]]:
     """
     Load the number of atoms, residues, and chains for a PDB
     """
-    pdb_size_metric_path = paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_size.json"
-    if not pdb_size_metric_path.is_file():
-        return None
+    return metric_store.load_metrics(pdb_id, metric_store.SIZE_COLUMNS)
+
 
-    with open(pdb_size_metric_path, mode="r", encoding="utf-8") as in_file:
-        return json.load(in_file)
+def load_all_pdb_size_metrics(pdb_ids: Optional[Iterable[str]] = None) -> dict[str, dict[str, int]]:
+    """
+    Load the number of atoms, residues, and chains for every PDB on file, or only those in `pdb_ids`.
+    """
+    return metric_store.load_all_metrics(metric_store.SIZE_COLUMNS, pdb_ids)
 
 
 def have_stoichiometry_on_file(pdb_id: str) -> bool:
     """
     Check to see if the stoichiometry of the PDB assembly has been recorded previously.
     """
-    return (paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_stoichiometry.json").is_file()
+    return metric_store.load_metrics(pdb_id, metric_store.STOICHIOMETRY_COLUMNS) is not None
 
 
 def save_stoichiometry(pdb_id: str, metrics: dict[int, int]) -> None:
     """
     Save the stoichiometry of the PDB assembly.
     """
-    with open(paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_stoichiometry.json", mode="w", encoding="utf-8") as out_file:
-        json.dump(metrics, out_file)
+    metric_store.save_metrics(pdb_id, {"stoichiometry": metrics})
 
 
 def load_stoichiometry(pdb_id: str) -> Optional[dict[int, int]]:
     """
     Load the stoichiometry of the PDB assembly.
     """
-    pdb_size_metric_path = paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_stoichiometry.json"
-    if not pdb_size_metric_path.is_file():
+    metrics = metric_store.load_metrics(pdb_id, metric_store.STOICHIOMETRY_COLUMNS)
+    if metrics is None:
         return None
 
-    with open(pdb_size_metric_path, mode="r", encoding="utf-8") as in_file:
-        return json.load(in_file)
+    return metrics["stoichiometry"]
+
+
+def load_all_stoichiometries(pdb_ids: Optional[Iterable[str]] = None) -> dict[str, dict[int, int]]:
+    """
+    Load the stoichiometry of every PDB assembly on file, or only those in `pdb_ids`.
+    """
+    return {
+        pdb_id: metrics["stoichiometry"]
+        for pdb_id, metrics in metric_store.load_all_metrics(metric_store.STOICHIOMETRY_COLUMNS, pdb_ids).items()
+    }
 
 
 def have_secondary_structure_on_file(pdb_id: str) -> bool:
     """
     Check to see if the secondary structure has been recorded previously.
     """
-    return (paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_secondary_structure.json").is_file()
+    return metric_store.load_metrics(pdb_id, metric_store.SECONDARY_STRUCTURE_COLUMNS) is not None
 
 
-def save_secondary_structure(pdb_id: str, metrics: dict[int, int]) -> None:
+def save_secondary_structure(pdb_id: str, metrics: dict[str, float]) -> None:
     """
     Save the secondary structure fractions.
     """
-    with open(
-        paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_secondary_structure.json", mode="w", encoding="utf-8"
-    ) as out_file:
-        json.dump(metrics, out_file)
+    metric_store.save_metrics(pdb_id, metrics)
 
 
-def load_secondary_structure(pdb_id: str) -> Optional[dict[int, int]]:
+def load_secondary_structure(pdb_id: str) -> Optional[dict[str, float]]:
     """
     Load the secondary structure fractions.
     """
-    pdb_size_metric_path = paths.PDB_FILTERING_METRIC_DIR / f"{pdb_id}_secondary_structure.json"
-    if not pdb_size_metric_path.is_file():
-        return None
+    return metric_store.load_metrics(pdb_id, metric_store.SECONDARY_STRUCTURE_COLUMNS)
 
-    with open(pdb_size_metric_path, mode="r", encoding="utf-8") as in_file:
-        return json.load(in_file)
+
+def load_all_secondary_structures(pdb_ids: Optional[Iterable[str]] = None) -> dict[str, dict[str, float]]:
+    """
+    Load the secondary structure fractions of every PDB on file, or only those in `pdb_ids`.
+    """
+    return metric_store.load_all_metrics(metric_store.SECONDARY_STRUCTURE_COLUMNS, pdb_ids)
+
+
+def iter_chunks(items: Iterable[T], chunk_size: int) -> Iterator[list[T]]:
+    """
+    Lazily split `items` into lists of at most `chunk_size` items.
+    """
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
 
 
 def guess_input_type(input: str) -> Optional[str]:
@@ -203,7 +479,7 @@ def guess_input_type(input: str) -> Optional[str]:
             return "id_file"
     elif Path(input).is_dir():
         return "pdb_dir"
-    elif len(input) == 4:
+    elif ids.normalize_pdb_id(input) is not None:
         return "pdb_id"
     else:
         return None
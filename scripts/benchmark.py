@@ -0,0 +1,65 @@
+"""
+Command-line entry-point to benchmark each pipeline stage offline and flag regressions
+against a stored baseline.
+
+Example:
+    python scripts/benchmark.py --save-baseline
+    python scripts/benchmark.py
+"""
+
+
+from pathlib import Path
+import json
+
+import typer
+
+from cli import benchmark
+from cli.paths import BENCHMARK_DIR
+
+
+def main(
+    output: Path = typer.Option(BENCHMARK_DIR / "latest.json", help="Where to write the benchmark results."),
+    baseline: Path = typer.Option(BENCHMARK_DIR / "baseline.json", help="Baseline results to compare against."),
+    save_baseline: bool = typer.Option(False, help="Also save these results as the new baseline."),
+    repeats: int = typer.Option(benchmark.BENCHMARK_REPEATS, help="Number of times to time each benchmark."),
+    tolerance: float = typer.Option(
+        benchmark.REGRESSION_TOLERANCE, help="Fractional slowdown from the baseline that counts as a regression."
+    ),
+    include_volumize: bool = typer.Option(True, help="Include the (slow) volumize benchmark."),
+    select: str = typer.Option(None, help="Only run benchmarks whose name contains this text."),
+):
+    """
+    Time each pipeline stage on the test structures and synthetic inputs, and compare to the baseline.
+    """
+    cases = benchmark.get_benchmark_cases(include_volumize)
+    if select is not None:
+        cases = {name: function for name, function in cases.items() if select in name}
+
+    results = benchmark.run_benchmarks(cases, repeats)
+    for name, result in results["benchmarks"].items():
+        print(f"{name:<60}{result['median']:>12.4f} s (min {result['min']:.4f} s)")
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, mode="w", encoding="utf-8") as out_file:
+        json.dump(results, out_file, indent=2)
+
+    if save_baseline:
+        baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline, mode="w", encoding="utf-8") as out_file:
+            json.dump(results, out_file, indent=2)
+        print(f"Saved baseline to: {baseline}")
+    elif baseline.is_file():
+        with open(baseline, mode="r", encoding="utf-8") as in_file:
+            regressions = benchmark.compare_to_baseline(results, json.load(in_file), tolerance)
+        if len(regressions) > 0:
+            print(f"Found {len(regressions)} regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise typer.Exit(code=1)
+        print("No regressions against the baseline")
+    else:
+        print(f"No baseline found at {baseline}, run with --save-baseline to create one")
+
+
+if "__main__" in __name__:
+    typer.run(main)
@@ -0,0 +1,55 @@
+"""
+Command-line entry-point to prefetch the MMTF files for a list of PDB IDs using
+many concurrent connections.
+
+Example:
+    python scripts/download.py data/rcsb_clusters/cluster-center-ids-40.txt --connections 32
+"""
+
+
+from pathlib import Path
+
+import typer
+
+from cli import ids, utils, rcsb
+from cli.constants import (
+    RCSB_MMTF_URL,
+    DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_BACKOFF,
+)
+
+
+def main(
+    input_list: Path = typer.Argument(..., help="List of PDB IDs to download"),
+    connections: int = typer.Option(DOWNLOAD_CONNECTIONS, help="Number of concurrent connections."),
+    retries: int = typer.Option(DOWNLOAD_RETRIES, help="Number of retries for each PDB ID."),
+    backoff: float = typer.Option(DOWNLOAD_BACKOFF, help="Initial delay in seconds between retries, doubled each time."),
+    url: str = typer.Option(RCSB_MMTF_URL, help="URL to fetch MMTF files from, with a '{pdb_id}' field."),
+    failed_list: Path = typer.Option(None, help="If given, write the PDB IDs that failed to download here."),
+):
+    """
+    Download the MMTF files for a list of PDB IDs, skipping any already downloaded.
+    """
+    utils.setup_dirs()
+
+    # NOTE: IDs are normalized, ignoring any resolution suffixes, and duplicates are dropped
+    pdb_ids = ids.read_id_file(input_list)
+
+    report = rcsb.download_pdb_files(pdb_ids, connections=connections, url=url, retries=retries, backoff=backoff)
+
+    print(f"Already downloaded: {report['cached']}")
+    print(f"Downloaded: {report['downloaded']}")
+    print(f"Failed: {len(report['failed'])}")
+    print(
+        f"Throughput: {report['downloaded'] / report['seconds']:.1f} files/s, "
+        f"{report['bytes'] / report['seconds'] / 1e6:.2f} MB/s over {report['seconds']:.1f} s"
+    )
+
+    if failed_list is not None:
+        with open(failed_list, mode="w", encoding="utf-8") as out_file:
+            out_file.writelines([f"{pdb_id}\n" for pdb_id in report["failed"]])
+
+
+if "__main__" in __name__:
+    typer.run(main)
@@ -0,0 +1,107 @@
+"""
+Command-line entry-point to filter a list of PDB IDs by size, secondary structure,
+and stoichiometry in a single pass, parsing each structure at most once.
+"""
+
+
+from functools import partial
+from pathlib import Path
+
+import typer
+
+from cli import utils, filtering, ids, pipeline, profiling, structure_cache
+from cli.constants import DOWNLOAD_CONNECTIONS
+
+
+def main(
+    input_list: Path = typer.Argument(..., help="List of PDB IDs to search"),
+    output_list: Path = typer.Argument(..., help="Resulting list of IDs that pass search criteria"),
+    min_atoms: int = typer.Option(1, help="Minimum number of atoms"),
+    max_atoms: int = typer.Option(None, help="Maximum number of atoms"),
+    min_residues: int = typer.Option(1, help="Minimum number of residues"),
+    max_residues: int = typer.Option(None, help="Maximum number of residues"),
+    min_chains: int = typer.Option(1, help="Minimum number of chains"),
+    max_chains: int = typer.Option(None, help="Maximum number of chains"),
+    min_chain_repeats: int = typer.Option(1, help="Minimum number of copies of each unique chain"),
+    max_chain_repeats: int = typer.Option(None, help="Maximum number of copies of each unique chain"),
+    min_unique_chains: int = typer.Option(1, help="Minimum number of unique chains"),
+    max_unique_chains: int = typer.Option(None, help="Maximum number of unique chains"),
+    stoichiometry_factorable: bool = typer.Option(
+        False,
+        help="If True, only structures where stoichiometry for all chains are factors of one another can pass, e.g. 8-4-2",
+    ),
+    min_helix: float = typer.Option(0.0, help="Minimum fraction of helix"),
+    max_helix: float = typer.Option(1.0, help="Maximum fraction of helix"),
+    min_strand: float = typer.Option(0.0, help="Minimum fraction of strand"),
+    max_strand: float = typer.Option(1.0, help="Maximum fraction of strand"),
+    min_coil: float = typer.Option(0.0, help="Minimum fraction of coil"),
+    max_coil: float = typer.Option(1.0, help="Maximum fraction of coil"),
+    jobs: int = typer.Option(1, help="Number of processes to use."),
+    connections: int = typer.Option(
+        DOWNLOAD_CONNECTIONS,
+        help="Number of concurrent connections downloading upcoming PDBs while others are processed, "
+        "0 to download each PDB as it is processed.",
+    ),
+    profile: bool = typer.Option(
+        False, help="Record per-stage timing and memory use, and report a summary at the end."
+    ),
+    persist_structures: bool = typer.Option(
+        False, help="Also save cleaned structures as memory-mappable arrays for faster loading by later runs."
+    ),
+):
+    """
+    Subset a PDB list based on size, secondary structure, and stoichiometry metrics.
+    """
+    # we'll be saving some data so make sure directories are available
+    utils.setup_dirs()
+    if profile:
+        profiling.enable_profiling("filter")
+    if persist_structures:
+        structure_cache.enable_structure_arrays()
+
+    metrics = {
+        "min_atoms": min_atoms,
+        "max_atoms": max_atoms,
+        "min_residues": min_residues,
+        "max_residues": max_residues,
+        "min_chains": min_chains,
+        "max_chains": max_chains,
+        "min_chain_repeats": min_chain_repeats,
+        "max_chain_repeats": max_chain_repeats,
+        "min_unique_chains": min_unique_chains,
+        "max_unique_chains": max_unique_chains,
+        "stoichiometry_factorable": stoichiometry_factorable,
+        "min_helix": min_helix,
+        "max_helix": max_helix,
+        "min_strand": min_strand,
+        "max_strand": max_strand,
+        "min_coil": min_coil,
+        "max_coil": max_coil,
+    }
+
+    # NOTE: IDs are normalized, ignoring any resolution suffixes, and duplicates are dropped
+    pdb_ids = ids.read_id_file(input_list)
+
+    # check the PDBs, writing out each one that passes as soon as it does
+    num_pdb_ids = 0
+    num_satisfied_pdb_ids = 0
+    with open(output_list, mode="w", encoding="utf-8") as out_file:
+        for pdb_id, satisfied in pipeline.map_pdb_ids_pipelined(
+            partial(filtering.pdb_satisfies_filters, metrics=metrics),
+            pdb_ids,
+            jobs,
+            stage="filter",
+            connections=connections,
+        ):
+            num_pdb_ids += 1
+            if satisfied:
+                out_file.write(f"{pdb_id}\n")
+                num_satisfied_pdb_ids += 1
+
+    print(f"Original number of PDBs: {num_pdb_ids}")
+    print(f"Final number of PDBs: {num_satisfied_pdb_ids}")
+    profiling.report_profile()
+
+
+if "__main__" in __name__:
+    typer.run(main)
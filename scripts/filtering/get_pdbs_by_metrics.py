@@ -8,11 +8,14 @@ Example:
 
 
 from pathlib import Path
+import itertools
 import warnings
 
 import typer
+from tqdm import tqdm
 
-from cli import analysis
+from cli import analysis, annotation_index, ids, utils
+from cli.paths import ANNOTATED_DF_DIR
 from cli.utils import guess_analysis_input_type
 
 
@@ -30,30 +33,25 @@ def main(
     max_dimension_two: float = typer.Option(None, help=""),
     min_dimension_three: float = typer.Option(0.0, help=""),
     max_dimension_three: float = typer.Option(None, help=""),
+    update_index: bool = typer.Option(
+        True, help="Add new or modified annotated dataframes to the annotation index before querying."
+    ),
+    resolution: float = typer.Option(
+        None,
+        help="Query the annotations volumized at this voxel size (e.g. by a --coarse-resolution run), "
+        "rather than those saved without a resolution.",
+    ),
 ):
     """
     Scan over annotated DFs for pores, pockets, and/or cavities matching given
     metric constraints.
+
+    Annotated DFs in the default location are queried through the annotation index, at one
+    voxel resolution, and reported by PDB ID. Other directories are read in full.
     """
     if (not find_pores) and (not find_pockets) and (not find_cavities):
         warnings.warn("You have not selected any volume types to find!")
 
-    input_type = guess_analysis_input_type(analysis_input)
-    if input_type == "file":
-        with open(analysis_input, mode="r", encoding="utf-8") as id_file:
-            pdb_ids = [line.strip() for line in id_file.readlines()]
-        annotation_paths, missing_dfs = analysis.get_annotations_by_id(pdb_ids)
-        if missing_dfs > 0:
-            warnings.warn(
-                f"Missing {missing_dfs} dataframes",
-            )
-    elif input_type == "dir":
-        annotation_paths = list(Path(analysis_input).glob("*.json"))
-    else:
-        raise RuntimeError("Input type not implemented")
-
-    pdb_annotations = analysis.get_pdb_annotations(annotation_paths)
-
     metrics = {
         "pores": find_pores,
         "pockets": find_pockets,
@@ -67,14 +65,57 @@ def main(
         "min_z": min_dimension_three,
         "max_z": max_dimension_three,
     }
-    selected_pdb_annotations = analysis.select_annotations_by_metrics(pdb_annotations, metrics)
 
-    annotation_names = [f"{name}\n" for name in selected_pdb_annotations.keys()]
-    with open(analysis_output, mode="w", encoding="utf-8") as out_file:
-        out_file.writelines(annotation_names)
+    input_type = guess_analysis_input_type(analysis_input)
+    if input_type == "file":
+        if update_index or not annotation_index.have_annotation_index():
+            annotation_index.update_annotation_index()
 
-    print(f"Found {len(annotation_names)} matching PDBs")
+        # the selection is only as large as the number of matches, the input IDs are streamed past it
+        index_stems = annotation_index.get_index_stems(resolution)
+        indexed_pdb_ids = set(index_stems.values())
+        selected_pdb_ids = {
+            index_stems[stem] for stem in annotation_index.query_annotation_index(metrics, stems=index_stems)
+        }
+        missing_dfs = 0
+        annotation_names = []
+        for pdb_id in ids.read_id_file(analysis_input):
+            if pdb_id not in indexed_pdb_ids:
+                missing_dfs += 1
+            elif pdb_id in selected_pdb_ids:
+                annotation_names.append(pdb_id)
+
+        if missing_dfs > 0:
+            warnings.warn(
+                f"Missing {missing_dfs} dataframes",
+            )
+    elif input_type == "dir" and Path(analysis_input).resolve() == ANNOTATED_DF_DIR.resolve():
+        if update_index or not annotation_index.have_annotation_index():
+            annotation_index.update_annotation_index()
+
+        index_stems = annotation_index.get_index_stems(resolution)
+        annotation_names = [
+            index_stems[stem] for stem in annotation_index.query_annotation_index(metrics, stems=index_stems)
+        ]
+    elif input_type == "dir":
+        # sharded (and possibly gzipped) like the default directory, or flat as written by older versions
+        annotation_paths = tqdm(
+            itertools.chain(
+                utils.iter_data_files(Path(analysis_input), ".json"), Path(analysis_input).glob("*.json")
+            ),
+            desc="Checking dataframes",
+        )
+        annotation_names = analysis.iter_annotations_by_metrics(annotation_paths, metrics)
+    else:
+        raise RuntimeError("Input type not implemented")
+
+    num_annotations = 0
+    with open(analysis_output, mode="w", encoding="utf-8") as out_file:
+        for annotation_name in annotation_names:
+            out_file.write(f"{annotation_name}\n")
+            num_annotations += 1
 
+    print(f"Found {num_annotations} matching PDBs")
 
 if "__main__" in __name__:
     typer.run(main)
\ No newline at end of file
@@ -4,16 +4,31 @@ fall within given ranges.
 """
 
 
+from functools import partial
 from pathlib import Path
-import warnings
+from typing import Optional
 
 import typer
-from tqdm import tqdm
-from biotite.structure.io import load_structure, save_structure, mmtf
 
-from volumizer.pdb import clean_structure
-from cli import analysis, pdb, rcsb, utils
-from cli.constants import PDB_ID_LENGTH, MAX_RESOLUTION
+from cli import analysis, filtering, ids, pdb, pipeline, profiling, structure_cache, utils
+from cli.constants import DOWNLOAD_CONNECTIONS
+
+
+def get_pdb_size_metrics(pdb_id: str, preparation_metrics: dict[str, int]) -> Optional[dict[str, int]]:
+    """
+    Compute and save the size metrics of a PDB.
+    Returns None if the PDB cannot be prepared.
+    """
+    prepared_structure = filtering.get_prepared_structure(pdb_id, preparation_metrics)
+    if prepared_structure is None:
+        return None
+
+    with profiling.profile_stage("size_metrics", pdb_id) as record:
+        pdb_size_metrics = pdb.get_pdb_size_metrics(prepared_structure)
+        record["atoms"] = len(prepared_structure)
+    utils.save_pdb_size_metrics(pdb_id, pdb_size_metrics)
+
+    return pdb_size_metrics
 
 
 def main(
@@ -25,12 +40,28 @@ def main(
     max_residues: int = typer.Option(None, help="Maximum number of residues"),
     min_chains: int = typer.Option(1, help="Minimum number of chains"),
     max_chains: int = typer.Option(None, help="Maximum number of chains"),
+    jobs: int = typer.Option(1, help="Number of processes to use."),
+    connections: int = typer.Option(
+        DOWNLOAD_CONNECTIONS,
+        help="Number of concurrent connections downloading upcoming PDBs while others are processed, "
+        "0 to download each PDB as it is processed.",
+    ),
+    profile: bool = typer.Option(
+        False, help="Record per-stage timing and memory use, and report a summary at the end."
+    ),
+    persist_structures: bool = typer.Option(
+        False, help="Also save cleaned structures as memory-mappable arrays for faster loading by later runs."
+    ),
 ):
     """
     Subset a PDB list based on some size metrics
     """
     # we'll be saving some data so make sure directories are available
     utils.setup_dirs()
+    if profile:
+        profiling.enable_profiling("get_pdbs_by_size")
+    if persist_structures:
+        structure_cache.enable_structure_arrays()
 
     metrics = {
         "min_atoms": min_atoms,
@@ -40,59 +71,32 @@ def main(
         "min_chains": min_chains,
         "max_chains": max_chains,
     }
-    preparation_metrics = {
-        "min_atoms": min_atoms,
-        "max_atoms": max_atoms * 2 if max_atoms is not None else None,
-        "min_residues": min_residues,
-        "max_residues": max_residues * 2 if max_residues is not None else None,
-        "min_chains": min_chains,
-        "max_chains": max_chains * 2 if max_chains is not None else None,
-    }
+    preparation_metrics = analysis.get_preparation_metrics(metrics)
 
-    # get the list of PDBs we need to check
-    with open(input_list, mode="r", encoding="utf-8") as in_file:
-        # NOTE: split around '.' to ignore any resolution suffixes
-        pdb_ids = [line.rstrip().split(".")[0][:PDB_ID_LENGTH] for line in in_file.readlines()]
-
-    # check the PDBs
-    satisfied_pdb_ids = []
-    for pdb_id in tqdm(pdb_ids):
-        if utils.have_pdb_size_metrics_on_file(pdb_id):
-            pdb_size_metrics = utils.load_pdb_size_metrics(pdb_id)
-        else:
-            if not utils.is_pdb_downloaded(pdb_id):
-                if not rcsb.download_pdb_file(pdb_id):
-                    continue
-
-            if not utils.is_pdb_prepared(pdb_id):
-                resolution = rcsb.get_resolution(utils.get_downloaded_pdb_path(pdb_id))
-                if resolution is not None and resolution > MAX_RESOLUTION:
-                    continue
-
-                # early exit and don't clean if the PDB file is too big
-                biological_assembly = rcsb.get_biological_assembly(pdb_id)
-                pdb_size_metrics = pdb.get_pdb_size_metrics(biological_assembly)
-                if not analysis.pdb_satisfies_metrics(pdb_size_metrics, preparation_metrics):
-                    continue
-
-                # size is worth cleaning
-                structure = rcsb.get_biological_assembly(pdb_id)
-                prepared_structure = clean_structure(structure)
-                save_structure(utils.get_prepared_pdb_path(pdb_id), prepared_structure)
-            
-            pdb_size_metrics = pdb.get_pdb_size_metrics(load_structure(utils.get_prepared_pdb_path(pdb_id)))
-            utils.save_pdb_size_metrics(pdb_id, pdb_size_metrics)
-
-        if pdb_size_metrics is None:
-            warnings.warn(f"No PDB size metrics for: {pdb_id}")
-        elif analysis.pdb_satisfies_metrics(pdb_size_metrics, metrics):
-            satisfied_pdb_ids.append(pdb_id)
+    # NOTE: IDs are normalized, ignoring any resolution suffixes, and duplicates are dropped
+    pdb_ids = ids.read_id_file(input_list)
 
+    # check the PDBs, only computing metrics we don't already have on file
+    num_pdb_ids = 0
+    num_satisfied_pdb_ids = 0
+    get_missing_size_metrics = partial(get_pdb_size_metrics, preparation_metrics=preparation_metrics)
     with open(output_list, mode="w", encoding="utf-8") as out_file:
-        out_file.writelines([f"{pdb}\n" for pdb in satisfied_pdb_ids])
-
-    print(f"Original number of PDBs: {len(pdb_ids)}")
-    print(f"Final number of PDBs: {len(satisfied_pdb_ids)}")
+        for pdb_id, pdb_size_metrics in pipeline.map_pdb_ids_pipelined(
+            get_missing_size_metrics,
+            pdb_ids,
+            jobs,
+            stage="size",
+            load_cached=utils.load_all_pdb_size_metrics,
+            connections=connections,
+        ):
+            num_pdb_ids += 1
+            if pdb_size_metrics is not None and analysis.pdb_satisfies_metrics(pdb_size_metrics, metrics):
+                out_file.write(f"{pdb_id}\n")
+                num_satisfied_pdb_ids += 1
+
+    print(f"Original number of PDBs: {num_pdb_ids}")
+    print(f"Final number of PDBs: {num_satisfied_pdb_ids}")
+    profiling.report_profile()
 
 
 if "__main__" in __name__:
@@ -5,15 +5,31 @@ and then guess the stoichiometry based on sequence alignment.
 
 
 from pathlib import Path
-import warnings
+from typing import Optional
 
 import typer
-from tqdm import tqdm
-from biotite.structure.io import load_structure, save_structure
 
-from volumizer.pdb import clean_structure
-from cli import utils, pdb, rcsb, analysis
-from cli.constants import MAX_RESOLUTION
+from cli import utils, pdb, filtering, analysis, ids, pipeline, profiling
+from cli.constants import DOWNLOAD_CONNECTIONS
+
+
+def get_stoichiometry(pdb_id: str) -> Optional[dict[int, int]]:
+    """
+    Compute and save the stoichiometry of a PDB.
+    Returns None if the PDB cannot be prepared.
+    """
+    # only the asymmetric unit is needed, along with the number of copies of each chain in the assembly
+    prepared_subunit = filtering.get_prepared_subunit(pdb_id)
+    if prepared_subunit is None:
+        return None
+    subunit, chain_multiplicities = prepared_subunit
+
+    with profiling.profile_stage("stoichiometry", pdb_id) as record:
+        stoichiometry = pdb.get_stoichiometry(subunit, chain_multiplicities=chain_multiplicities)
+        record["atoms"] = len(subunit)
+    utils.save_stoichiometry(pdb_id, stoichiometry)
+
+    return stoichiometry
 
 
 def main(
@@ -27,6 +43,15 @@ def main(
         False,
         help="If True, only structures where stoichiometry for all chains are factors of one another can pass, e.g. 8-4-2",
     ),
+    jobs: int = typer.Option(1, help="Number of processes to use."),
+    connections: int = typer.Option(
+        DOWNLOAD_CONNECTIONS,
+        help="Number of concurrent connections downloading upcoming PDBs while others are processed, "
+        "0 to download each PDB as it is processed.",
+    ),
+    profile: bool = typer.Option(
+        False, help="Record per-stage timing and memory use, and report a summary at the end."
+    ),
 ):
     """
     For each PDB file in a list, read in the file, determine the sequence of all chains
@@ -34,6 +59,8 @@ def main(
     """
     # we'll be saving some data so make sure directories are available
     utils.setup_dirs()
+    if profile:
+        profiling.enable_profiling("get_pdbs_by_stoichiometry")
 
     metrics = {
         "min_chain_repeats": min_chain_repeats,
@@ -43,43 +70,29 @@ def main(
         "stoichiometry_factorable": stoichiometry_factorable,
     }
 
-    # get the list of PDBs we need to check
-    with open(input_list, mode="r", encoding="utf-8") as in_file:
-        # NOTE: split around '.' to ignore any resolution suffixes
-        pdb_ids = [line.rstrip().split(".")[0] for line in in_file.readlines()]
-
-    # check the PDBS
-    satisfied_pdb_ids = []
-    for pdb_id in tqdm(pdb_ids):
-        if utils.have_stoichiometry_on_file(pdb_id):
-            stoichiometry = utils.load_stoichiometry(pdb_id)
-        else:
-            if not utils.is_pdb_downloaded(pdb_id):
-                if not rcsb.download_pdb_file(pdb_id):
-                    continue
-
-            if not utils.is_pdb_prepared(pdb_id):
-                resolution = rcsb.get_resolution(utils.get_downloaded_pdb_path(pdb_id))
-                if resolution is not None and resolution > MAX_RESOLUTION:
-                    continue
-
-                structure = rcsb.get_biological_assembly(pdb_id)
-                prepared_structure = clean_structure(structure)
-                save_structure(utils.get_prepared_pdb_path(pdb_id), prepared_structure)
-            
-            stoichiometry = pdb.get_stoichiometry(load_structure(utils.get_prepared_pdb_path(pdb_id)))
-            utils.save_stoichiometry(pdb_id, stoichiometry)
-
-        if stoichiometry is None:
-            warnings.warn(f"No stoichiometry: {pdb_id}")
-        elif analysis.pdb_satisfies_stoichiometry(stoichiometry, metrics):
-            satisfied_pdb_ids.append(pdb_id)
+    # NOTE: IDs are normalized, ignoring any resolution suffixes, and duplicates are dropped
+    pdb_ids = ids.read_id_file(input_list)
 
+    # check the PDBs, only computing metrics we don't already have on file
+    num_pdb_ids = 0
+    num_satisfied_pdb_ids = 0
     with open(output_list, mode="w", encoding="utf-8") as out_file:
-        out_file.writelines([f"{pdb}\n" for pdb in satisfied_pdb_ids])
-
-    print(f"Original number of PDBs: {len(pdb_ids)}")
-    print(f"Final number of PDBs: {len(satisfied_pdb_ids)}")
+        for pdb_id, stoichiometry in pipeline.map_pdb_ids_pipelined(
+            get_stoichiometry,
+            pdb_ids,
+            jobs,
+            stage="stoichiometry",
+            load_cached=utils.load_all_stoichiometries,
+            connections=connections,
+        ):
+            num_pdb_ids += 1
+            if stoichiometry is not None and analysis.pdb_satisfies_stoichiometry(stoichiometry, metrics):
+                out_file.write(f"{pdb_id}\n")
+                num_satisfied_pdb_ids += 1
+
+    print(f"Original number of PDBs: {num_pdb_ids}")
+    print(f"Final number of PDBs: {num_satisfied_pdb_ids}")
+    profiling.report_profile()
 
 
 if "__main__" in __name__:
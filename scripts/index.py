@@ -0,0 +1,33 @@
+"""
+Command-line entry-point to build or update the annotation index used by
+`scripts/filtering/get_pdbs_by_metrics.py`.
+"""
+
+
+from pathlib import Path
+
+import typer
+
+from cli import annotation_index
+from cli.paths import ANNOTATED_DF_DIR, ANNOTATION_INDEX_DIR
+
+
+def main(
+    annotation_dir: Path = typer.Argument(ANNOTATED_DF_DIR, help="Directory of annotated dataframes"),
+    index_dir: Path = typer.Option(ANNOTATION_INDEX_DIR, help="Directory to write the index to"),
+    rebuild: bool = typer.Option(False, help="Discard any existing index and re-read every dataframe."),
+):
+    """
+    Compile the annotated dataframes into a columnar index, only reading dataframes
+    that are new or modified since the last update.
+    """
+    if rebuild:
+        (index_dir / annotation_index.SOURCES_FILE).unlink(missing_ok=True)
+
+    added, removed = annotation_index.update_annotation_index(annotation_dir, index_dir)
+
+    print(f"Indexed {added} new or modified dataframes, removed {removed}")
+
+
+if "__main__" in __name__:
+    typer.run(main)
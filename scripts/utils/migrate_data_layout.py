@@ -0,0 +1,25 @@
+"""
+Move the data directory written by older versions to the sharded layout, optionally gzip compressing each file.
+"""
+
+
+import typer
+
+from cli import utils
+
+
+def main(
+    compress: bool = typer.Option(False, help="Gzip compress stored structures and annotation dataframes."),
+) -> None:
+    """
+    Move the data directory written by older versions to the sharded layout, optionally gzip compressing each file.
+    """
+    utils.setup_dirs()
+
+    moved = utils.migrate_data_layout(compress)
+    for data_dir_name, count in moved.items():
+        print(f"Migrated {count} {data_dir_name} files")
+
+
+if "__main__" in __name__:
+    typer.run(main)
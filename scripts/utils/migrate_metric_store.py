@@ -0,0 +1,28 @@
+"""
+Copy the per-PDB JSON filtering metrics written by older versions into the metric store.
+"""
+
+
+from pathlib import Path
+
+import typer
+
+from cli import utils, metric_store
+from cli.paths import PDB_FILTERING_METRIC_DIR
+
+
+def main(
+    metric_dir: Path = typer.Argument(PDB_FILTERING_METRIC_DIR, help="Directory of per-PDB JSON metric files"),
+) -> None:
+    """
+    Copy the per-PDB JSON filtering metrics written by older versions into the metric store.
+    """
+    utils.setup_dirs()
+
+    migrated = metric_store.migrate_json_metrics(metric_dir)
+    for kind, count in migrated.items():
+        print(f"Migrated {count} {kind} files")
+
+
+if "__main__" in __name__:
+    typer.run(main)
@@ -8,24 +8,42 @@ from pathlib import Path
 
 import typer
 
-from cli.rcsb import parse_cluster_file
+from cli import filtering, ids, utils
 
 
 def main(
     cluster_file: Path= typer.Argument(..., help="Sequence ID cluster file downloaded frome RCSB"),
     output_file: Path= typer.Argument(..., help="Output text file listing RCSB IDs matching first entry of each cluster"),
+    cluster_map: Path = typer.Option(
+        None, help="If given, also save every member of every cluster here, as a NumPy archive."
+    ),
+    check_representatives: bool = typer.Option(
+        False,
+        help="Download each cluster's first member and check its resolution, falling back to the next member "
+        "of the cluster if it fails.",
+    ),
 ) -> None:
     """
     Open an RCSB cluster file and generate a text file with one ID per line,
     where each ID is the first ID in the cluster.
     """
-
-    with open(cluster_file, mode="r", encoding="utf-8") as file_in:
-        pdbs = parse_cluster_file(file_in.readlines())
+    clusters = ids.read_cluster_file(cluster_file)
+    if cluster_map is not None:
+        ids.save_cluster_map(clusters, cluster_map)
+
+    if check_representatives:
+        utils.setup_dirs()
+        representatives = dict.fromkeys(
+            pdb_id
+            for pdb_id in ids.select_representatives(clusters, filtering.is_pdb_usable)
+            if pdb_id is not None
+        )
+    else:
+        representatives = ids.get_representatives(clusters)
 
     with open(output_file, mode="w", encoding="utf-8") as file_out:
-        file_out.writelines(pdbs)
+        file_out.writelines([f"{pdb_id}\n" for pdb_id in representatives])
 
 
 if "__main__" in __name__:
-    typer.run(main)
\ No newline at end of file
+    typer.run(main)
@@ -2,44 +2,109 @@
 Command-line entry-point to find pores and cavities in PDBs.
 """
 
+from contextlib import nullcontext
 from pathlib import Path
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar, Union
+import shutil
+import time
+import warnings
 
 import typer
-import multiprocessing
 import pandas as pd
+from tqdm import tqdm
 
 from volumizer import volumizer
 from volumizer import utils as volumizer_utils
 from volumizer.constants import VOXEL_SIZE
 from cli import utils as cli_utils
-from cli import rcsb
-from cli.paths import ANNOTATED_DF_DIR, ANNOTATED_PDB_DIR
+from cli import analysis, coordination, ids, inventory, pipeline, rcsb, ledger, profiling, scheduling, supervisor
+from cli.paths import ANNOTATED_DF_DIR, PARTIAL_DIR
+from cli.constants import VOLUMIZE_TIMEOUT, DOWNLOAD_CONNECTIONS, PIPELINE_QUEUE_PER_WORKER
 
 
-def volumize_pdb_id(pdb_id: str) -> None:
+VOLUMIZE_STAGE = "volumize"
+
+T = TypeVar("T")
+
+
+def get_volumize_stage(resolution: Optional[float] = None) -> str:
     """
-    Download the given PDB ID and then volumize it.
+    Return the ledger stage for volumizing, which is kept per resolution when one is given.
     """
-    if not cli_utils.have_annotation(cli_utils.get_annotated_pdb_path(pdb_id).stem):
-        print(f"Working on: {pdb_id}")
+    if resolution is None:
+        return VOLUMIZE_STAGE
 
-        if not rcsb.download_pdb_file(pdb_id):
-            print(f"Skipping {pdb_id}, cannot download")
-            return None
+    return f"{VOLUMIZE_STAGE}.{resolution}"
 
-        downloaded_pdb_path = cli_utils.get_downloaded_pdb_path(pdb_id)        
-        annotated_pdb_path = cli_utils.get_annotated_pdb_path(pdb_id)
-        annotated_df_path = cli_utils.get_annotated_df_path(pdb_id)
 
-        volumizer.volumize_pdb_and_save(downloaded_pdb_path, annotated_pdb_path, annotated_df_path)
+def volumize_and_save(structure_path: Path, annotated_structure_path: Path, annotated_df_path: Path) -> None:
+    """
+    Volumize a structure file, saving the annotated structure in the format given by its path's suffix.
+    """
+    if structure_path.suffix == ".gz":
+        # the volumizer loads with biotite's load_structure, which cannot read gzipped files
+        plain_structure_path = PARTIAL_DIR / f"{coordination.get_owner()}_{structure_path.name.removesuffix('.gz')}"
+        with cli_utils.open_data_file(structure_path) as in_file, open(plain_structure_path, mode="wb") as out_file:
+            shutil.copyfileobj(in_file, out_file)
+        try:
+            volumize_and_save(plain_structure_path, annotated_structure_path, annotated_df_path)
+        finally:
+            plain_structure_path.unlink(missing_ok=True)
+        return
 
-        print(f"Annotation dataframe saved as: {annotated_df_path}")
-        print(f"Annotated PDB saved as: {annotated_pdb_path}")
-        print(f"Quick annotation output:")
-        print(pd.read_json(annotated_df_path))
-    else:
+    if annotated_structure_path.suffix == ".pdb":
+        volumizer.volumize_pdb_and_save(structure_path, annotated_structure_path, annotated_df_path)
+        return
+
+    # the volumizer writes PDB text, which is converted once here so that every later load is fast
+    annotated_pdb_path = annotated_structure_path.with_suffix(".pdb")
+    volumizer.volumize_pdb_and_save(structure_path, annotated_pdb_path, annotated_df_path)
+    annotated_structure = cli_utils.read_structure(
+        annotated_pdb_path, cli_utils.STRUCTURE_EXTRA_FIELDS["annotated"]
+    )
+    cli_utils.write_structure(annotated_structure_path, annotated_structure)
+    annotated_pdb_path.unlink()
+
+
+def volumize_pdb_id(pdb_id: str, resolution: Optional[float] = None) -> Optional[Path]:
+    """
+    Download the given PDB ID and then volumize it.
+    If `resolution` is given the structure is volumized at that voxel size and saved under it.
+    Returns the path to the annotation dataframe, or None if the PDB cannot be downloaded.
+    """
+    annotated_df_path = cli_utils.get_annotated_df_path(pdb_id, resolution)
+    if cli_utils.have_annotation(cli_utils.get_annotation_stem(pdb_id, resolution)):
         print(pdb_id)
-        print(pd.read_json(cli_utils.get_annotated_df_path(pdb_id).with_suffix(".json")))        
+        print(pd.read_json(annotated_df_path))
+        return annotated_df_path
+
+    print(f"Working on: {pdb_id}")
+    if resolution is not None:
+        volumizer_utils.set_resolution(resolution)
+
+    if not rcsb.download_pdb_file(pdb_id):
+        print(f"Skipping {pdb_id}, cannot download")
+        return None
+
+    downloaded_pdb_path = cli_utils.get_downloaded_pdb_path(pdb_id)
+    annotated_pdb_path = cli_utils.get_annotated_pdb_path(pdb_id, resolution)
+
+    with profiling.profile_stage("volumize", pdb_id) as record:
+        with cli_utils.atomic_output(annotated_pdb_path, annotated_df_path) as (partial_pdb_path, partial_df_path):
+            volumize_and_save(downloaded_pdb_path, partial_pdb_path, partial_df_path)
+
+        # size metrics are only on file if the PDB went through the filters
+        pdb_size_metrics = cli_utils.load_pdb_size_metrics(pdb_id)
+        if pdb_size_metrics is not None:
+            record["atoms"] = pdb_size_metrics["atoms"]
+
+    print(f"Annotation dataframe saved as: {annotated_df_path}")
+    print(f"Annotated PDB saved as: {annotated_pdb_path}")
+    print(f"Quick annotation output:")
+    print(pd.read_json(annotated_df_path))
+
+    return annotated_df_path
 
 
 def volumize_pdb_file(pdb_file: Path) -> None:
@@ -49,10 +114,11 @@ def volumize_pdb_file(pdb_file: Path) -> None:
     if not cli_utils.have_annotation(pdb_file.stem):
         print(f"Working on: {pdb_file}")
 
-        annotated_pdb_path = (ANNOTATED_PDB_DIR / pdb_file.stem).with_suffix(".pdb")
-        annotated_df_path = (ANNOTATED_DF_DIR / pdb_file.stem).with_suffix(".json")
+        annotated_pdb_path = cli_utils.get_annotated_pdb_path(pdb_file.stem)
+        annotated_df_path = cli_utils.get_annotated_df_path(pdb_file.stem)
 
-        volumizer.volumize_pdb_and_save(pdb_file, annotated_pdb_path, annotated_df_path)
+        with cli_utils.atomic_output(annotated_pdb_path, annotated_df_path) as (partial_pdb_path, partial_df_path):
+            volumize_and_save(pdb_file, partial_pdb_path, partial_df_path)
 
         print(f"Annotation dataframe saved as: {annotated_df_path}")
         print(f"Annotated PDB saved as: {annotated_pdb_path}")
@@ -60,7 +126,145 @@ def volumize_pdb_file(pdb_file: Path) -> None:
         print(pd.read_json(annotated_df_path))
     else:
         print(pdb_file)
-        print(pd.read_json(ANNOTATED_DF_DIR / pdb_file.stem).with_suffix(".json"))
+        print(pd.read_json(cli_utils.get_annotated_df_path(pdb_file.stem)))
+
+
+def record_killed_pdb(pdb_id: str, reason: str, seconds: float, stage: str = VOLUMIZE_STAGE) -> None:
+    """
+    Record a PDB whose worker was killed as failed in the ledger, along with its size if known,
+    and release the lease the worker held on it, removing any outputs it left part written.
+    """
+    pdb_size_metrics = cli_utils.load_pdb_size_metrics(pdb_id)
+    if pdb_size_metrics is not None:
+        reason = (
+            f"{reason} ({pdb_size_metrics['atoms']} atoms, {pdb_size_metrics['residues']} residues, "
+            f"{pdb_size_metrics['chains']} chains)"
+        )
+    ledger.finish_job(pdb_id, stage, "failed", seconds, reason)
+    dead_owner = coordination.release_dead_lease(pdb_id, stage)
+    if dead_owner is not None:
+        cli_utils.remove_partial_outputs(pdb_id, dead_owner)
+
+
+def run_scheduled(
+    function: Callable[[T], Any],
+    costs: dict[T, float],
+    jobs: int,
+    cost_unit: str,
+    timeout: Optional[float] = None,
+    max_memory_mb: Optional[float] = None,
+    seconds_per_cost: Optional[float] = None,
+    on_killed: Optional[Callable[[T, str, float], None]] = None,
+    connections: int = 0,
+) -> None:
+    """
+    Run the work longest first in cost-balanced batches, each batch in a fresh supervised worker
+    so that memory growth is capped, and show progress (and so the projected completion time) weighted by cost.
+
+    Any item running longer than `timeout` seconds, or whose worker grows beyond `max_memory_mb`, is killed
+    and passed to `on_killed`, and the rest of its batch carries on in a new worker.
+    If the items are PDB IDs, `connections` concurrent connections download upcoming PDBs ahead of the workers.
+    """
+    batches = scheduling.schedule_by_cost(costs, jobs)
+    batch_costs = [sum(costs[item] for item in batch) for batch in batches]
+    print(f"Scheduled {len(costs)} jobs in {len(batches)} batches")
+    if seconds_per_cost is not None:
+        projected_hours = scheduling.project_makespan(batch_costs, jobs) * seconds_per_cost / 3600
+        print(f"Projected completion in {projected_hours:.1f} hours, based on previous runs")
+
+    # NOTE: prefetching runs in a separate process, as the supervisor forks workers throughout the run
+    inventory.prepare_workers()
+    prefetch_context = (
+        pipeline.prefetch_pdb_files(
+            list(scheduling.get_start_order(batches, jobs)), jobs * PIPELINE_QUEUE_PER_WORKER, connections
+        )
+        if connections > 0
+        else nullcontext()
+    )
+    with prefetch_context as advance_prefetch, tqdm(
+        total=sum(batch_costs), unit=cost_unit, unit_scale=True, desc="Volumizing"
+    ) as progress:
+        for item, status, detail, seconds in supervisor.run_supervised(
+            function, batches, jobs, timeout, max_memory_mb
+        ):
+            if status == "killed":
+                warnings.warn(f"Killed {item}: {detail}")
+                if on_killed is not None:
+                    on_killed(item, detail, seconds)
+            elif status == "failed":
+                warnings.warn(f"Failed on {item}: {detail}")
+            if advance_prefetch is not None:
+                progress.set_postfix(advance_prefetch(), refresh=False)
+            progress.update(costs[item])
+
+
+def volumize_pdb_ids(
+    pdb_ids: list[str],
+    jobs: int,
+    resolution: Optional[float] = None,
+    timeout: Optional[float] = None,
+    max_memory_mb: Optional[float] = None,
+    connections: int = DOWNLOAD_CONNECTIONS,
+) -> None:
+    """
+    Volumize a list of PDB IDs, skipping any already completed at this resolution,
+    downloading upcoming PDBs over `connections` concurrent connections as others are volumized.
+
+    Each PDB is leased before it is volumized, so several nodes sharing the data directory can
+    work through the same list without repeating each other's work.
+    """
+    stage = get_volumize_stage(resolution)
+
+    # a single query tells us everything already completed, failed PDBs are retried
+    completed_pdb_ids = ledger.get_job_ids(stage)
+    remaining_pdb_ids = [pdb_id for pdb_id in pdb_ids if pdb_id not in completed_pdb_ids]
+
+    # annotations made before the ledger existed are only on file, so record them as done
+    annotated_pdb_ids = [
+        pdb_id
+        for pdb_id in remaining_pdb_ids
+        if cli_utils.have_annotation(cli_utils.get_annotation_stem(pdb_id, resolution))
+    ]
+    ledger.record_done_jobs(annotated_pdb_ids, stage)
+    completed_pdb_ids.update(annotated_pdb_ids)
+    remaining_pdb_ids = [pdb_id for pdb_id in remaining_pdb_ids if pdb_id not in completed_pdb_ids]
+    print(f"Skipping {len(pdb_ids) - len(remaining_pdb_ids)} already volumized PDBs")
+
+    run_scheduled(
+        partial(
+            ledger.run_claimed_job, partial(volumize_pdb_id, resolution=resolution), stage=stage, since=time.time()
+        ),
+        scheduling.get_pdb_costs(remaining_pdb_ids),
+        jobs,
+        cost_unit="atom",
+        timeout=timeout,
+        max_memory_mb=max_memory_mb,
+        seconds_per_cost=scheduling.estimate_seconds_per_cost(stage),
+        on_killed=partial(record_killed_pdb, stage=stage),
+        connections=connections,
+    )
+
+
+def screen_coarse_annotations(
+    pdb_ids: list[str], coarse_resolution: float, metrics: dict[str, Union[bool, float]]
+) -> list[str]:
+    """
+    Return the PDB IDs whose coarse annotation has a volume that may satisfy `metrics` at a finer resolution.
+
+    Annotations are read one at a time, and PDBs without a coarse annotation are dropped.
+    """
+    coarse_metrics = analysis.get_coarse_metrics(metrics)
+    accepted_types = analysis.compile_accepted_types(metrics)
+    inventory.refresh(ANNOTATED_DF_DIR)
+
+    return [
+        pdb_id
+        for pdb_id in tqdm(pdb_ids, desc="Screening coarse annotations")
+        if inventory.exists(
+            annotation_path := cli_utils.get_annotated_df_path(pdb_id, coarse_resolution), confirm_missing=False
+        )
+        and analysis.annotation_satisfies_metrics(pd.read_json(annotation_path), coarse_metrics, accepted_types)
+    ]
 
 
 def main(
@@ -69,34 +273,101 @@ def main(
     ),
     resolution: float = typer.Option(VOXEL_SIZE, help="Edge-length of voxels used to discretize the structure."),
     jobs: int = typer.Option(1, help="Number of threads to use."),
+    connections: int = typer.Option(
+        DOWNLOAD_CONNECTIONS,
+        help="Number of concurrent connections downloading upcoming PDBs while others are volumized, "
+        "0 to download each PDB as it is volumized.",
+    ),
+    timeout: float = typer.Option(
+        VOLUMIZE_TIMEOUT, help="Seconds after which a PDB is killed and recorded as failed (0 for no limit)."
+    ),
+    max_memory: float = typer.Option(
+        None, help="Resident memory in MB above which a worker is killed and its PDB recorded as failed."
+    ),
+    coarse_resolution: float = typer.Option(
+        None,
+        help="If given, volumize a list of PDB IDs at this voxel size first, and only re-volumize "
+        "those matching the metrics below at --resolution. Outputs are saved per resolution.",
+    ),
+    find_pores: bool = typer.Option(False, help="Coarse screen: keep PDBs with pores."),
+    find_pockets: bool = typer.Option(False, help="Coarse screen: keep PDBs with pockets."),
+    find_cavities: bool = typer.Option(False, help="Coarse screen: keep PDBs with cavities."),
+    min_volume: float = typer.Option(0.0, help="Coarse screen: minimum volume."),
+    max_volume: float = typer.Option(None, help="Coarse screen: maximum volume."),
+    min_dimension_one: float = typer.Option(0.0, help="Coarse screen: minimum first dimension."),
+    max_dimension_one: float = typer.Option(None, help="Coarse screen: maximum first dimension."),
+    min_dimension_two: float = typer.Option(0.0, help="Coarse screen: minimum second dimension."),
+    max_dimension_two: float = typer.Option(None, help="Coarse screen: maximum second dimension."),
+    min_dimension_three: float = typer.Option(0.0, help="Coarse screen: minimum third dimension."),
+    max_dimension_three: float = typer.Option(None, help="Coarse screen: maximum third dimension."),
+    profile: bool = typer.Option(
+        False, help="Record per-stage timing and memory use, and report a summary at the end."
+    ),
 ):
     """
     Find pores and cavities in the supplied PDB files.
     """
     cli_utils.setup_dirs()
     volumizer_utils.set_resolution(resolution)
+    if profile:
+        profiling.enable_profiling("volumize")
 
     input_type = cli_utils.guess_input_type(volumize_input)
 
+    metrics = {
+        "pores": find_pores,
+        "pockets": find_pockets,
+        "cavities": find_cavities,
+        "min_volume": min_volume,
+        "max_volume": max_volume,
+        "min_x": min_dimension_one,
+        "max_x": max_dimension_one,
+        "min_y": min_dimension_two,
+        "max_y": max_dimension_two,
+        "min_z": min_dimension_three,
+        "max_z": max_dimension_three,
+    }
+    if coarse_resolution is not None:
+        if input_type != "id_file":
+            warnings.warn("--coarse-resolution only applies to lists of PDB IDs and will be ignored")
+        elif not (find_pores or find_pockets or find_cavities):
+            warnings.warn("You have not selected any volume types to find, so no PDB will pass the coarse screen!")
+
     if input_type == "pdb_id":
-        volumize_pdb_id(volumize_input)
+        pdb_id = ids.normalize_pdb_id(volumize_input)
+        if ledger.is_job_done(pdb_id, VOLUMIZE_STAGE):
+            print(pdb_id)
+            print(pd.read_json(cli_utils.get_annotated_df_path(pdb_id)))
+        else:
+            ledger.run_job(volumize_pdb_id, pdb_id, VOLUMIZE_STAGE)
     elif input_type == "pdb_file":
         pdb_file = Path(volumize_input)
         volumize_pdb_file(pdb_file)
     elif input_type == "id_file":
-        with open(volumize_input, mode="r", encoding="utf-8") as id_file:
-            pdb_ids = [line.strip() for line in id_file.readlines()]
-        tasks = [[pdb_id] for pdb_id in pdb_ids]
-        with multiprocessing.Pool(processes=jobs) as pool:
-            pool.starmap(volumize_pdb_id, tasks)
+        pdb_ids = list(ids.read_id_file(Path(volumize_input)))
+        volumize_ids = partial(
+            volumize_pdb_ids, jobs=jobs, timeout=timeout or None, max_memory_mb=max_memory, connections=connections
+        )
+        if coarse_resolution is None:
+            volumize_ids(pdb_ids)
+        else:
+            volumize_ids(pdb_ids, resolution=coarse_resolution)
+            fine_pdb_ids = screen_coarse_annotations(pdb_ids, coarse_resolution, metrics)
+            print(f"{len(fine_pdb_ids)} of {len(pdb_ids)} PDBs pass the coarse screen")
+            volumize_ids(fine_pdb_ids, resolution=resolution)
     elif input_type == "pdb_dir":
-        pdb_files = Path(volumize_input).glob("*.pdb")
-        tasks = [[pdb_file] for pdb_file in pdb_files]
-        with multiprocessing.Pool(processes=jobs) as pool:
-            pool.starmap(volumize_pdb_file, tasks)
+        # without size metrics on file, the file size is the best guess at cost
+        pdb_file_sizes = {
+            pdb_file: float(pdb_file.stat().st_size) for pdb_file in Path(volumize_input).glob("*.pdb")
+        }
+        run_scheduled(
+            volumize_pdb_file, pdb_file_sizes, jobs, cost_unit="B", timeout=timeout or None, max_memory_mb=max_memory
+        )
     else:
         raise RuntimeError("File mode not implemented")
 
+    profiling.report_profile()
+
 
 if "__main__" in __name__:
     typer.run(main)
@@ -0,0 +1,91 @@
+"""
+Tests for claiming and releasing leases on PDBs.
+"""
+
+import os
+import time
+
+import pytest
+
+from cli import coordination, paths
+
+
+LEASE_TIMEOUT = 60.0
+
+
+@pytest.fixture(autouse=True)
+def lease_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "LEASE_DIR", tmp_path / "leases")
+
+
+def claim_as(owner, monkeypatch, pdb_id="1ABC", stage="test"):
+    monkeypatch.setattr(coordination, "get_owner", lambda: owner)
+    return coordination.claim_lease(pdb_id, stage, LEASE_TIMEOUT)
+
+
+def make_stale(path):
+    stale_time = time.time() - 2 * LEASE_TIMEOUT
+    os.utime(path, (stale_time, stale_time))
+
+
+def test_claim_fresh_lease(monkeypatch):
+    assert claim_as("node-a_1", monkeypatch)
+    assert coordination.get_lease_owner(coordination.get_lease_path("1ABC", "test")) == "node-a_1"
+
+
+def test_claim_held_lease(monkeypatch):
+    assert claim_as("node-a_1", monkeypatch)
+    assert not claim_as("node-b_1", monkeypatch)
+    assert coordination.get_lease_owner(coordination.get_lease_path("1ABC", "test")) == "node-a_1"
+
+
+def test_claim_stale_lease(monkeypatch):
+    assert claim_as("node-a_1", monkeypatch)
+    lease_path = coordination.get_lease_path("1ABC", "test")
+    make_stale(lease_path)
+
+    assert claim_as("node-b_1", monkeypatch)
+    assert coordination.get_lease_owner(lease_path) == "node-b_1"
+    assert not lease_path.with_suffix(".break").exists()
+
+
+def test_claim_stale_lease_while_another_node_breaks_it(monkeypatch):
+    assert claim_as("node-a_1", monkeypatch)
+    lease_path = coordination.get_lease_path("1ABC", "test")
+    make_stale(lease_path)
+    breaker_path = lease_path.with_suffix(".break")
+    breaker_path.write_text("node-c_1", encoding="utf-8")
+
+    assert not claim_as("node-b_1", monkeypatch)
+    assert coordination.get_lease_owner(lease_path) == "node-a_1"
+    assert breaker_path.exists()
+
+
+def test_claim_stale_lease_with_stale_breaker(monkeypatch):
+    assert claim_as("node-a_1", monkeypatch)
+    lease_path = coordination.get_lease_path("1ABC", "test")
+    make_stale(lease_path)
+    breaker_path = lease_path.with_suffix(".break")
+    breaker_path.write_text("node-c_1", encoding="utf-8")
+    make_stale(breaker_path)
+
+    # the stale breaker is cleared, so the next attempt takes over the lease
+    assert not claim_as("node-b_1", monkeypatch)
+    assert not breaker_path.exists()
+    assert claim_as("node-b_1", monkeypatch)
+    assert coordination.get_lease_owner(lease_path) == "node-b_1"
+
+
+def test_release_taken_over_lease(monkeypatch):
+    assert claim_as("node-a_1", monkeypatch)
+    lease_path = coordination.get_lease_path("1ABC", "test")
+    make_stale(lease_path)
+    assert claim_as("node-b_1", monkeypatch)
+
+    monkeypatch.setattr(coordination, "get_owner", lambda: "node-a_1")
+    coordination.release_lease("1ABC", "test")
+    assert coordination.get_lease_owner(lease_path) == "node-b_1"
+
+    monkeypatch.setattr(coordination, "get_owner", lambda: "node-b_1")
+    coordination.release_lease("1ABC", "test")
+    assert not lease_path.exists()
@@ -0,0 +1,115 @@
+"""
+Tests that clustering chains into a stoichiometry, with its length bounds on sequence identity,
+matches aligning every chain against every cluster as the original implementation did.
+"""
+
+import biotite.structure as bts
+import pytest
+from biotite.sequence import ProteinSequence
+from biotite.sequence.align import SubstitutionMatrix, align_optimal
+from biotite.structure.io import load_structure
+
+from cli import paths, pdb
+from cli.constants import RESIDUE_LETTER_CONVERSION, SEQUENCE_IDENTITY_CUTOFF
+
+
+def get_reference_sequences(structure):
+    return [
+        "".join([RESIDUE_LETTER_CONVERSION.get(residue.res_name[0], "X") for residue in bts.residue_iter(chain)])
+        for chain in bts.chain_iter(structure)
+    ]
+
+
+def get_reference_stoichiometry(sequences, match_cutoff=SEQUENCE_IDENTITY_CUTOFF):
+    # the original all-pairs clustering, aligning every chain against each cluster's first sequence
+    sequences = list(sequences)
+    cluster_count = 0
+    clusters = {cluster_count: [sequences.pop()]}
+    while len(sequences) > 0:
+        query_sequence = sequences.pop()
+        joined_cluster = False
+        for cluster_id, cluster_sequences in clusters.items():
+            alignment = align_optimal(
+                ProteinSequence(query_sequence),
+                ProteinSequence(cluster_sequences[0]),
+                SubstitutionMatrix.std_protein_matrix(),
+                max_number=1,
+            )
+            identity = sum([1 for position in alignment[0].trace if position[-1] != -1]) / alignment[0].trace.shape[0]
+            if identity >= match_cutoff:
+                clusters[cluster_id].append(query_sequence)
+                joined_cluster = True
+                break
+
+        if not joined_cluster:
+            cluster_count += 1
+            clusters[cluster_count] = [query_sequence]
+
+    return {cluster_id: len(cluster_sequences) for cluster_id, cluster_sequences in clusters.items()}
+
+
+def load_chain(name, chain_id, trim_residues=0):
+    structure = load_structure(paths.TEST_DATA_DIR / f"{name}.pdb")
+    chain = structure[bts.filter_amino_acids(structure)]
+    chain = chain[chain.res_id >= chain.res_id[0] + trim_residues]
+    chain.chain_id[:] = chain_id
+
+    return chain
+
+
+def build_assembly(chains):
+    chain_ids = iter("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+    chain_arrays = [load_chain(name, next(chain_ids), *trim_residues) for name, *trim_residues in chains]
+    assembly = chain_arrays[0]
+    for chain_array in chain_arrays[1:]:
+        assembly += chain_array
+
+    return assembly
+
+
+@pytest.mark.parametrize(
+    "chains",
+    [
+        # homo-oligomers
+        [("pore",)] * 4,
+        [("hub",)] * 6,
+        # hetero-oligomers
+        [("pore",), ("hub",), ("pore",), ("hub",), ("hub",)],
+        [("cavity",), ("pocket",), ("pore",), ("hub",)],
+        # copies trimmed to either side of the identity cutoff
+        [("pore",), ("pore", 5), ("pore", 10), ("pore", 12), ("pore", 15), ("pore", 25)],
+        [("hub", 12), ("hub",), ("cavity",), ("hub", 11), ("cavity", 13)],
+    ],
+)
+def test_stoichiometry_matches_all_pairs_alignment(chains):
+    assembly = build_assembly(chains)
+
+    assert pdb.get_chain_sequences(assembly) == get_reference_sequences(assembly)
+    assert pdb.get_stoichiometry(assembly) == get_reference_stoichiometry(get_reference_sequences(assembly))
+
+
+@pytest.mark.parametrize(
+    "sequences",
+    [
+        # the last sequence is the cluster representative (the reference), the other the query
+        # len(reference) / (len(query) + len(reference)) is exactly the cutoff, accepted without aligning
+        ["A", "ACDEFGHIK"],
+        ["ACDEFGHIK", "A"],
+        # len(reference) / len(query) is exactly the cutoff, so the sequences are aligned
+        ["ACDEFGHIKL", "ACDEFGHIK"],
+        ["LACDEFGHIK", "ACDEFGHIK"],
+        ["ACDEFGHIK", "ACDEFGHIKL"],
+        # len(reference) / len(query) is just below the cutoff, rejected without aligning
+        ["ACDEFGHIKL", "ACDEFGHI"],
+        ["ACDEFGHI", "ACDEFGHIKL"],
+        # a homo- and a hetero-oligomer, with a chain at each bound
+        ["ACDEFGHIK", "A", "ACDEFGHIK", "ACDEFGHIKL", "ACDEFGHIK"],
+        ["ACDEFGHIKL", "ACDEFGHI", "MNPQRSTVWY", "ACDEFGHIKL", "MNPQRSTVWY"],
+    ],
+)
+def test_length_bounds_at_the_cutoff(sequences):
+    match_cutoff = 0.9
+
+    assert pdb.get_sequence_stoichiometry(sequences, match_cutoff) == get_reference_stoichiometry(
+        sequences, match_cutoff
+    )
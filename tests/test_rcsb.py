@@ -0,0 +1,138 @@
+"""
+Tests for downloading MMTF files concurrently, against a stand-in for the RCSB on localhost.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import asyncio
+import gzip
+import threading
+
+import pytest
+from biotite.structure.io import load_structure, mmtf
+
+from cli import inventory, paths, rcsb, utils
+
+
+@pytest.fixture(scope="module")
+def mmtf_content():
+    mmtf_file = mmtf.MMTFFile()
+    mmtf.set_structure(mmtf_file, load_structure(paths.TEST_DATA_DIR / "pore.pdb"))
+    content = BytesIO()
+    mmtf_file.write(content)
+
+    return content.getvalue()
+
+
+@pytest.fixture
+def data_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "PARTIAL_DIR", tmp_path / "partial")
+    monkeypatch.setattr(paths, "INVENTORY_DIR", tmp_path / "inventory")
+    monkeypatch.setitem(utils.STRUCTURE_DIRS, "downloaded", tmp_path / "downloaded_pdbs")
+    monkeypatch.setattr(utils, "is_compression_enabled", lambda: False)
+    monkeypatch.setattr(inventory, "_SNAPSHOTS", {})
+    paths.PARTIAL_DIR.mkdir()
+
+    return tmp_path
+
+
+@pytest.fixture
+def server():
+    """
+    Serve each PDB ID's queued responses in turn, as (status, body), repeating the last one.
+    """
+    responses: dict[str, list[tuple[int, bytes]]] = {}
+    requests: dict[str, int] = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            pdb_id = self.path.strip("/")
+            requests[pdb_id] = requests.get(pdb_id, 0) + 1
+            queued = responses.get(pdb_id, [(404, b"")])
+            status, body = queued.pop(0) if len(queued) > 1 else queued[0]
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server_thread = threading.Thread(target=http_server.serve_forever, args=(0.05,), daemon=True)
+    server_thread.start()
+    yield f"http://127.0.0.1:{http_server.server_port}/{{pdb_id}}", responses, requests
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def download(pdb_id, url, retries=2):
+    return asyncio.run(rcsb.download_pdb_file_async(pdb_id, url, retries, 0.0))
+
+
+def assert_no_partial_files():
+    assert list(paths.PARTIAL_DIR.iterdir()) == []
+
+
+def test_missing_entry_fails_without_retrying(data_dirs, server):
+    url, responses, requests = server
+    responses["1ABC"] = [(404, b"")]
+
+    assert download("1ABC", url) == ("failed", 0)
+    assert requests["1ABC"] == 1
+    assert not utils.get_downloaded_pdb_path("1ABC").exists()
+    assert_no_partial_files()
+
+
+def test_transient_error_is_retried(data_dirs, server, mmtf_content):
+    url, responses, requests = server
+    responses["1ABC"] = [(503, b""), (200, mmtf_content)]
+
+    assert download("1ABC", url) == ("downloaded", len(mmtf_content))
+    assert requests["1ABC"] == 2
+    assert utils.get_downloaded_pdb_path("1ABC").read_bytes() == mmtf_content
+    assert_no_partial_files()
+
+
+def test_gzipped_response_is_saved_decompressed(data_dirs, server, mmtf_content):
+    url, responses, _ = server
+    responses["1ABC"] = [(200, gzip.compress(mmtf_content))]
+
+    assert download("1ABC", url)[0] == "downloaded"
+    assert utils.get_downloaded_pdb_path("1ABC").read_bytes() == mmtf_content
+    assert_no_partial_files()
+
+
+def test_invalid_content_is_retried_then_fails(data_dirs, server):
+    url, responses, requests = server
+    responses["1ABC"] = [(200, b"not an MMTF file")]
+
+    assert download("1ABC", url, retries=2) == ("failed", 0)
+    assert requests["1ABC"] == 3
+    assert not utils.get_downloaded_pdb_path("1ABC").exists()
+    assert_no_partial_files()
+
+
+def test_existing_file_is_cached(data_dirs, server, mmtf_content):
+    url, _, requests = server
+    download_path = utils.get_downloaded_pdb_path("1ABC")
+    download_path.parent.mkdir(parents=True)
+    download_path.write_bytes(mmtf_content)
+
+    assert download("1ABC", url) == ("cached", 0)
+    assert "1ABC" not in requests
+    assert_no_partial_files()
+
+
+def test_download_many(data_dirs, server, mmtf_content):
+    url, responses, _ = server
+    for pdb_id in ("1ABC", "2ABC", "3ABC"):
+        responses[pdb_id] = [(200, mmtf_content)]
+    responses["4ABC"] = [(404, b"")]
+
+    report = rcsb.download_pdb_files(["1ABC", "2ABC", "3ABC", "4ABC"], connections=2, url=url, backoff=0.0)
+
+    assert report["downloaded"] == 3
+    assert report["failed"] == ["4ABC"]
+    assert report["bytes"] == 3 * len(mmtf_content)
+    assert_no_partial_files()